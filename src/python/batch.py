@@ -0,0 +1,145 @@
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import tape
+import values
+
+
+# The number of bytes of slots a chunk should use, so that it stays in the L2 cache.
+CHUNK_BYTES = 256 * 1024
+
+# Evaluate a tape on large batches of points on the CPU.
+# The batch is split into chunks whose slots fit in the cache, and the chunks are evaluated
+# on a thread pool : NumPy releases the GIL inside ufuncs, so this scales with the cores.
+# Each worker has a preallocated slot buffer, so evaluating does not allocate per chunk.
+# The evaluator also bounds batches of boxes with interval arithmetic (see eval_bounds).
+class BatchEvaluator:
+    def __init__(self, tap, workers = None, chunk_size = None):
+        self.tap = tap
+        self.workers = workers if workers is not None else os.cpu_count()
+        assert(self.workers > 0)
+        # One row per slot, plus one row of scratch space for FMA.
+        if chunk_size is None:
+            chunk_size = max(256, CHUNK_BYTES // (4 * (tap.slot_count + 1)))
+        self.chunk_size = chunk_size
+
+        # Decode the tape once.
+        self.instrs = [tape.decode_instruction(instr) for instr in tap.instructions]
+        self.constants = np.array(tap.constant_pool, dtype = np.float32)
+
+        self.executor = ThreadPoolExecutor(self.workers)
+        self.buffers = queue.Queue()
+        for _ in range(self.workers):
+            self.buffers.put(np.empty((tap.slot_count + 1, chunk_size), dtype = np.float32))
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Evaluate the tape on a single chunk, writing the densities to out.
+    def eval_chunk(self, x, y, z, t, out):
+        buf = self.buffers.get()
+        try:
+            n = len(out)
+            slots = buf[:, :n]
+            scratch = slots[-1]
+            slots[0] = x
+            slots[1] = y
+            slots[2] = z
+            slots[3] = t
+            with np.errstate(all = 'ignore'):
+                for op, out_slot, in_slotA, in_slotB, constA, constB in self.instrs:
+                    # Constants are broadcast by NumPy. An input is only read if the operator uses it
+                    # (see Tape.operands) : OP_CONST reads the constant pool, and the unary operators
+                    # don't read in_slotB.
+                    a = self.constants[in_slotA] if constA or op == tape.OP_CONST else slots[in_slotA]
+                    b = None
+                    if op in tape.BINARY_OPS:
+                        b = self.constants[in_slotB] if constB else slots[in_slotB]
+                    dst = slots[out_slot]
+                    if op == tape.OP_CONST: dst[:] = a
+                    elif op == tape.OP_SIN: np.sin(a, out = dst)
+                    elif op == tape.OP_COS: np.cos(a, out = dst)
+                    elif op == tape.OP_EXP: np.exp(a, out = dst)
+                    elif op == tape.OP_SQRT: np.sqrt(a, out = dst)
+                    elif op == tape.OP_NEG: np.negative(a, out = dst)
+                    elif op == tape.OP_ADD: np.add(a, b, out = dst)
+                    elif op == tape.OP_SUB: np.subtract(a, b, out = dst)
+                    elif op == tape.OP_MUL: np.multiply(a, b, out = dst)
+                    elif op == tape.OP_DIV: np.divide(a, b, out = dst)
+                    elif op == tape.OP_MIN: np.minimum(a, b, out = dst)
+                    elif op == tape.OP_MAX: np.maximum(a, b, out = dst)
+                    elif op == tape.OP_COPY: dst[:] = a
+                    elif op == tape.OP_SQUARE: np.square(a, out = dst)
+                    elif op == tape.OP_ABS: np.abs(a, out = dst)
+                    elif op == tape.OP_FMA:
+                        # a or b can be in the output slot.
+                        np.multiply(a, b, out = scratch)
+                        np.add(scratch, dst, out = dst)
+                    elif op == tape.OP_FLOOR: np.floor(a, out = dst)
+                    elif op == tape.OP_MOD:
+                        # Same as the GPU : a - b * floor(a / b).
+                        np.divide(a, b, out = scratch)
+                        np.floor(scratch, out = scratch)
+                        np.multiply(scratch, b, out = scratch)
+                        np.subtract(a, scratch, out = dst)
+                    else: assert(False)
+            out[:] = slots[self.tap.out_slot]
+        finally:
+            self.buffers.put(buf)
+
+    # Evaluate the tape at every point (x, y, z, t). The inputs can be arrays of any
+    # shape or floats, as long as they broadcast together : the output has the broadcast shape.
+    def eval(self, x, y, z, t = 0.0):
+        x, y, z, t = np.broadcast_arrays(*[np.asarray(v, dtype = np.float32) for v in [x, y, z, t]])
+        shape = x.shape
+        x, y, z, t = [v.reshape(-1) for v in [x, y, z, t]]
+        out = np.empty(x.size, dtype = np.float32)
+
+        futures = []
+        for start in range(0, x.size, self.chunk_size):
+            end = min(start + self.chunk_size, x.size)
+            futures.append(self.executor.submit(self.eval_chunk,
+                x[start:end], y[start:end], z[start:end], t[start:end], out[start:end]))
+        # Propagate the exceptions of the workers.
+        for f in futures:
+            f.result()
+        return out.reshape(shape)
+
+    # Bound the density over a single chunk of boxes, writing the bounds to out_low and out_high.
+    def eval_bounds_chunk(self, ix, iy, iz, t, out_low, out_high):
+        with np.errstate(all = 'ignore'):
+            bounds = self.tap.eval(ix, iy, iz, values.Intervals(t, t), values.Intervals)
+        out_low[:] = bounds.low
+        out_high[:] = bounds.high
+
+    # Bound the density over every box ix * iy * iz at time t, with interval arithmetic :
+    # this gives the same bounds as Tape.eval_bounds on each box, in one pass over the tape per chunk.
+    # The intervals are values.Intervals whose endpoints (and t) broadcast together : 
+    # this returns a values.Intervals with the broadcast shape.
+    def eval_bounds(self, ix, iy, iz, t = 0.0):
+        ends = np.broadcast_arrays(*[np.asarray(v, dtype = np.float64) 
+            for v in [ix.low, ix.high, iy.low, iy.high, iz.low, iz.high, t]])
+        shape = ends[0].shape
+        ends = [v.reshape(-1) for v in ends]
+        size = ends[0].size
+        low = np.empty(size, dtype = np.float64)
+        high = np.empty(size, dtype = np.float64)
+
+        futures = []
+        for start in range(0, size, self.chunk_size):
+            end = min(start + self.chunk_size, size)
+            x0, x1, y0, y1, z0, z1, ts = [v[start:end] for v in ends]
+            futures.append(self.executor.submit(self.eval_bounds_chunk,
+                values.Intervals(x0, x1), values.Intervals(y0, y1), values.Intervals(z0, z1), ts,
+                low[start:end], high[start:end]))
+        for f in futures:
+            f.result()
+        return values.Intervals(low.reshape(shape), high.reshape(shape))
@@ -0,0 +1,88 @@
+import time
+import numpy as np
+
+import csg
+import tape
+from __engine import __engine
+
+
+# Compare the trace time of the linear and Morton layouts of the voxel masks (see mask_layout in voxelizer.fut).
+# The linear layout favours rays that move along z, so we render the same scene
+# from cameras looking along each axis and along diagonals.
+# Run with : make bench-layout
+
+WIDTH, HEIGHT = 1200, 900
+FOV_RAD = np.deg2rad(70)
+VOXEL_DIMS = (16, 4, 4)
+BRICK_DIMS = (64, 8)
+FRAME_POS = (-10.0, -10.0, -10.0)
+FRAME_SIZE = 20.0
+# The distance of the cameras to the center of the frame.
+CAM_DIST = 20.0
+# The number of renders per camera : the first one is a warm-up and is not timed.
+RUNS = 10
+
+# The directions the cameras look in.
+DIRECTIONS = {
+    "+x" : (1, 0, 0), "-x" : (-1, 0, 0),
+    "+y" : (0, 1, 0), "-y" : (0, -1, 0),
+    "+z" : (0, 0, 1), "-z" : (0, 0, -1),
+    "xy" : (1, 1, 0), "xz" : (1, 0, 1), "yz" : (0, 1, 1),
+    "xyz" : (1, 1, 1), "-xyz" : (-1, -1, -1),
+}
+
+# A camera at CAM_DIST from the center of the frame, looking at it in the given direction.
+# This returns the position, forward, right and up vectors.
+def camera(direction):
+    forward = np.array(direction, dtype = float)
+    forward /= np.linalg.norm(forward)
+    # Any vector that is not parallel to forward will do.
+    helper = np.array([0.0, 1.0, 0.0]) if abs(forward[1]) < 0.9 else np.array([1.0, 0.0, 0.0])
+    right = np.cross(forward, helper)
+    right /= np.linalg.norm(right)
+    up = np.cross(right, forward)
+    center = np.array(FRAME_POS) + FRAME_SIZE / 2
+    return center - CAM_DIST * forward, forward, right, up
+
+# The average time (in ms) to render with the given render function, for each direction.
+def time_renders(render, voxels, args):
+    times = dict()
+    for name, direction in DIRECTIONS.items():
+        cam = camera(direction)
+        samples = []
+        for i in range(RUNS):
+            t0 = time.perf_counter()
+            render(0.0, WIDTH, HEIGHT, *[x for v in cam for x in v], FOV_RAD, voxels, *args).get()
+            t1 = time.perf_counter()
+            if i > 0:
+                samples.append(1000.0 * (t1 - t0))
+        times[name] = sum(samples) / len(samples)
+    return times
+
+def main():
+    fut = __engine()
+    # A shape with details along every axis : a sphere minus a lattice of cylinders.
+    X, Y, Z = csg.X(), csg.Y(), csg.Z()
+    sphere = X * X + Y * Y + Z * Z - csg.const(9 * 9)
+    holes = csg.min(
+        csg.min(X * X + Y * Y - csg.const(3 * 3), Y * Y + Z * Z - csg.const(3 * 3)),
+        Z * Z + X * X - csg.const(3 * 3))
+    tap = tape.Tape(csg.max(sphere, -holes))
+    args = tape.tape_args(tap)
+
+    results = []
+    for morton in [False, True]:
+        voxels = fut.voxelize(*VOXEL_DIMS, morton, 0.0, *FRAME_POS, FRAME_SIZE, *args)
+        results.append(("voxels", morton, time_renders(fut.render, voxels, args)))
+        bricks = fut.voxelize_bricks(*BRICK_DIMS, morton, 0.0, *FRAME_POS, FRAME_SIZE, *args)
+        results.append(("bricks", morton, time_renders(fut.render_bricks, bricks, args)))
+
+    print("Trace time in ms (%dx%d pixels, average of %d renders)" % (WIDTH, HEIGHT, RUNS - 1))
+    print("%-8s %-8s " % ("", "layout") + " ".join("%7s" % name for name in DIRECTIONS))
+    for kind, morton, times in results:
+        layout = "morton" if morton else "linear"
+        print("%-8s %-8s " % (kind, layout) + " ".join("%7.2f" % times[name] for name in DIRECTIONS))
+
+
+if __name__ == "__main__":
+    main()
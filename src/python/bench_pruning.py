@@ -0,0 +1,59 @@
+import csg
+import tape
+from __engine import __engine
+
+
+# Measure how tight the bounds of each bound mode are on representative shapes (see pruning.fut) :
+# the fraction of the cells of a grid that the bounds prove to be inside or outside,
+# against a ground truth from dense sampling. The voxelizer can only skip these cells,
+# so changes to the evaluators can be judged on this ratio and not only on speed.
+# Run with : make bench-pruning
+
+# The grid of cells and the samples per cell side for the ground truth.
+GRID_DIMS = [16, 64]
+SAMPLES = 5
+FRAME_POS = (-10.0, -10.0, -10.0)
+FRAME_SIZE = 20.0
+# The bound modes, in the order of the pruning_stats entry point.
+MODES = ["interval", "affine", "centered"]
+
+def shapes():
+    X, Y, Z = csg.X(), csg.Y(), csg.Z()
+    c = csg.const
+    def sphere(x, y, z, r):
+        return x * x + y * y + z * z - c(r * r)
+    def box(x, y, z, r):
+        return csg.max(csg.max(csg.abs(x), csg.abs(y)), csg.abs(z)) - c(r)
+    return {
+        "sphere" : sphere(X, Y, Z, 8.0),
+        "box" : box(X, Y, Z, 6.0),
+        "torus" : csg.square(csg.sqrt(X * X + Y * Y) - c(6.0)) + Z * Z - c(2.0 * 2.0),
+        # A sphere with a box cut out : the CSG min/max nodes.
+        "csg" : csg.max(sphere(X, Y, Z, 8.0), -box(X - c(4.0), Y - c(4.0), Z - c(4.0), 5.0)),
+        # A gyroid inside a sphere : the trigonometric nodes.
+        "gyroid" : csg.max(
+            csg.sin(X) * csg.cos(Y) + csg.sin(Y) * csg.cos(Z) + csg.sin(Z) * csg.cos(X),
+            sphere(X, Y, Z, 9.0)),
+        # Infinitely many spheres : the mod nodes.
+        "repeat" : csg.repeat(lambda x, y, z, t: sphere(x, y, z, 1.5), (4.0, 4.0, 4.0)),
+    }
+
+def main():
+    fut = __engine()
+    print("Pruned cells, as a percentage of the cells where all the samples agree (%d^3 samples per cell)" % SAMPLES)
+    print("%-8s %6s %-10s %8s %8s %8s %8s" % ("shape", "grid", "mode", "inside", "outside", "pruned", "wrong"))
+    for name, expr in shapes().items():
+        args = tape.tape_args(tape.Tape(expr))
+        for d in GRID_DIMS:
+            stats = fut.pruning_stats(d, SAMPLES, 0.0, *FRAME_POS, FRAME_SIZE, *args).get()
+            for mode, (pruned_in, pruned_out, sampled_in, sampled_out, wrong) in zip(MODES, stats):
+                percent = lambda n, total: 100.0 * n / total if total > 0 else 100.0
+                print("%-8s %6d %-10s %7.1f%% %7.1f%% %7.1f%% %8d" % (name, d, mode,
+                    percent(pruned_in, sampled_in),
+                    percent(pruned_out, sampled_out),
+                    percent(pruned_in + pruned_out, sampled_in + sampled_out),
+                    wrong))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import batch
+import tape
+import values
+
+
+# Out-of-core voxelization, for grids that don't fit in device memory (2048^3 and up).
+# The frame is split in chunks that are voxelized one after the other by the engine
+# (see voxelize_chunk in dda.fut), and streamed into a memory-mapped grid on disk.
+# The grid is packed along z : voxel (x, y, z) is bit z % 8 of byte grid[x, y, z // 8],
+# the same layout as np.packbits(..., axis = 2, bitorder = 'little').
+# A 2048^3 grid is 1 GB on disk, and only one chunk at a time is in memory.
+# The chunks can also be spread over several devices (see voxelize_tiled).
+
+# Open a packed grid of dimension dim stored in a .npy file.
+# mode is the mode of np.memmap : 'r' to read, 'w+' to create a new (zeroed) grid.
+def open_grid(path, dim, mode = 'r'):
+    assert(dim % 8 == 0)
+    if mode == 'w+':
+        return np.lib.format.open_memmap(path, mode = mode, dtype = np.uint8, shape = (dim, dim, dim // 8))
+    grid = np.load(path, mmap_mode = mode)
+    assert(grid.dtype == np.uint8 and grid.shape == (dim, dim, dim // 8))
+    return grid
+
+# Unpack the voxels [x0, x1) * [y0, y1) * [z0, z1) of a packed grid as booleans.
+# z0 should be a multiple of 8.
+def grid_voxels(grid, x0, x1, y0, y1, z0, z1):
+    assert(z0 % 8 == 0)
+    bits = np.unpackbits(grid[x0:x1, y0:y1, z0 // 8 : (z1 + 7) // 8], axis = 2, bitorder = 'little')
+    return bits[:, :, :z1 - z0].astype(bool)
+
+# Fill the chunks of a new (zeroed) grid that interval arithmetic proves to be completely inside 
+# or outside, without launching anything on the device. This returns the other chunks, 
+# as their first voxel and their world position. All the chunks are bounded in one batch.
+def classify_chunks(grid, tap, dim, frame_pos, frame_size, t, chunk_dim):
+    cell_size = frame_size / dim
+    chunk_size = cell_size * chunk_dim
+    chunk_count = dim // chunk_dim
+    cs = np.indices((chunk_count,) * 3).reshape(3, -1)
+    lows = [frame_pos[k] + chunk_size * cs[k] for k in range(3)]
+    with batch.BatchEvaluator(tap) as evaluator:
+        bounds = evaluator.eval_bounds(*[values.Intervals(low, low + chunk_size) for low in lows], t)
+    chunks = []
+    for i in range(cs.shape[1]):
+        pos = [frame_pos[k] + chunk_size * int(cs[k, i]) for k in range(3)]
+        x, y, z = [int(c) * chunk_dim for c in cs[:, i]]
+        # The inside is where the density is negative or zero.
+        if bounds.high[i] <= 0.0:
+            grid[x:x+chunk_dim, y:y+chunk_dim, z//8:(z+chunk_dim)//8] = 0xFF
+        # A new grid is zeroed : there is nothing to do outside.
+        elif bounds.low[i] <= 0.0:
+            chunks.append(((x, y, z), pos))
+    return chunks
+
+# Copy the words computed by voxelize_chunk for the chunk whose first voxel is (x, y, z) to the grid.
+def write_chunk(grid, chunk_dim, x, y, z, words):
+    # The words are little-endian, so their bytes are in the same order as the bits.
+    block = np.ascontiguousarray(words.get(), dtype = '<u4').view(np.uint8)
+    grid[x:x+chunk_dim, y:y+chunk_dim, z//8:(z+chunk_dim)//8] = block
+
+# The items of a queue shared by several threads, until it is empty.
+def queue_items(q):
+    while True:
+        try:
+            yield q.get_nowait()
+        except queue.Empty:
+            return
+
+# Voxelize the chunks with one engine. The device computes asynchronously : we launch the next chunk
+# before waiting for the previous one, so that writing to the grid overlaps with voxelizing.
+def voxelize_chunks(fut, grid, chunks, args, chunk_dim, brick_dim, chunk_size, t):
+    pending = None
+    for (x, y, z), pos in chunks:
+        words = fut.voxelize_chunk(chunk_dim, brick_dim, t, *pos, chunk_size, *args)
+        if pending is not None:
+            write_chunk(grid, chunk_dim, *pending)
+        pending = (x, y, z, words)
+    if pending is not None:
+        write_chunk(grid, chunk_dim, *pending)
+
+# Voxelize the density at time t into a packed grid of dimension dim, in the file at path.
+# chunk_dim is the dimension of the chunks (dim should be a multiple of it, and it should be
+# a multiple of 32 and of brick_dim), brick_dim the dimension of the bricks inside a chunk.
+# The chunks that interval arithmetic proves to be completely inside or outside
+# are filled on the host, without launching anything on the device.
+# This returns the memory-mapped grid.
+def voxelize_to_disk(fut, tap, path, dim, frame_pos, frame_size, t = 0.0, chunk_dim = 256, brick_dim = 8):
+    assert(dim % chunk_dim == 0)
+    assert(chunk_dim % 32 == 0 and chunk_dim % brick_dim == 0)
+    grid = open_grid(path, dim, mode = 'w+')
+    chunks = classify_chunks(grid, tap, dim, frame_pos, frame_size, t, chunk_dim)
+    voxelize_chunks(fut, grid, chunks, tape.tape_args(tap), chunk_dim, brick_dim, frame_size / dim * chunk_dim, t)
+    grid.flush()
+    return grid
+
+# The same as voxelize_to_disk, with several engines (see devices.py) that voxelize chunks in parallel.
+# Each engine runs in its own thread and takes the next chunk as soon as it is done, 
+# so faster devices voxelize more chunks. The grid is in the file at path, or in memory if path is None.
+def voxelize_tiled(engines, tap, dim, frame_pos, frame_size, t = 0.0, chunk_dim = 256, brick_dim = 8, path = None):
+    assert(dim % chunk_dim == 0)
+    assert(chunk_dim % 32 == 0 and chunk_dim % brick_dim == 0)
+    if path is None:
+        grid = np.zeros((dim, dim, dim // 8), dtype = np.uint8)
+    else:
+        grid = open_grid(path, dim, mode = 'w+')
+    chunks = queue.Queue()
+    for chunk in classify_chunks(grid, tap, dim, frame_pos, frame_size, t, chunk_dim):
+        chunks.put(chunk)
+    args = tape.tape_args(tap)
+    chunk_size = frame_size / dim * chunk_dim
+    # The chunks don't overlap : the threads write to different parts of the grid.
+    # Calling result() raises the exceptions of the threads.
+    with ThreadPoolExecutor(max_workers = len(engines)) as pool:
+        jobs = [pool.submit(voxelize_chunks, fut, grid, queue_items(chunks), args, chunk_dim, brick_dim, chunk_size, t) for fut in engines]
+        for job in jobs:
+            job.result()
+    if path is not None:
+        grid.flush()
+    return grid
@@ -0,0 +1,20 @@
+import numpy as np
+
+
+# A clipmap keeps voxels around the camera for worlds of any size (see clipmap.fut) :
+# levels of dim^3 voxels centred on the camera, where the cells of each level are twice
+# as large as the cells of the previous level. The host chooses the origins of the levels,
+# and moves the clipmap (see move_clipmap in dda.fut) when they change.
+
+# The origins of the levels of a clipmap centred on pos, as cells of each level.
+# cell_size is the size of the cells of the first level, and dim should be a multiple of 4.
+# The origins are even, so that the cells of a level are exactly covered by cells of the next level,
+# and they only change when the camera moves by two cells of a level.
+# This is why dim / 2 has to be even.
+def level_origins(pos, levels, dim, cell_size):
+    assert(dim % 4 == 0)
+    origins = np.empty((levels, 3), dtype = np.int64)
+    for i in range(levels):
+        size = cell_size * 2 ** i
+        origins[i] = 2 * np.floor(np.asarray(pos) / (2 * size)).astype(np.int64) - dim // 2
+    return origins
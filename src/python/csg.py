@@ -1,5 +1,6 @@
 import graphviz
 import math 
+import builtins
 
 
 # Nullary operators (no inputs)
@@ -21,6 +22,14 @@ OP_MUL = 12
 OP_DIV = 13
 OP_MIN = 14
 OP_MAX = 15
+# Unary operators (these are also introduced by the peephole pass, see fuse)
+OP_ABS = 16
+OP_SQUARE = 17
+# Ternary operators
+OP_FMA = 18 # fused multiply-add : fma(a, b, c) = a * b + c
+# Repetition operators (see repeat)
+OP_FLOOR = 19
+OP_MOD = 20 # mod(a, b) = a - b * floor(a / b), which has the sign of b
 
 # The number of inputs an operator is supposed to have
 def op_arity(op):
@@ -40,6 +49,11 @@ def op_arity(op):
     elif op == OP_DIV: return 2
     elif op == OP_MIN: return 2
     elif op == OP_MAX: return 2
+    elif op == OP_ABS: return 1
+    elif op == OP_SQUARE: return 1
+    elif op == OP_FMA: return 3
+    elif op == OP_FLOOR: return 1
+    elif op == OP_MOD: return 2
     else: assert(False)            
 
 def is_axis_op(op):
@@ -65,9 +79,15 @@ def op_to_string(op):
     elif op == OP_DIV: return "DIV"
     elif op == OP_MIN: return "MIN"
     elif op == OP_MAX: return "MAX"
+    elif op == OP_ABS: return "ABS"
+    elif op == OP_SQUARE: return "SQUARE"
+    elif op == OP_FMA: return "FMA"
+    elif op == OP_FLOOR: return "FLOOR"
+    elif op == OP_MOD: return "MOD"
     else: assert(False)            
 
-# Evaluate an operator on float inputs
+# Evaluate an operator on float inputs.
+# Careful : min, max and abs are shadowed by the node helpers of this module. 
 def eval_op(op, args):
     assert(is_input_op(op))
     assert(op_arity(op) == len(args))
@@ -81,8 +101,13 @@ def eval_op(op, args):
     elif op == OP_SUB: return args[0] - args[1]
     elif op == OP_MUL: return args[0] * args[1]
     elif op == OP_DIV: return args[0] / args[1]
-    elif op == OP_MIN: return min(args[0], args[1])
-    elif op == OP_MAX: return max(args[0], args[1])
+    elif op == OP_MIN: return builtins.min(args[0], args[1])
+    elif op == OP_MAX: return builtins.max(args[0], args[1])
+    elif op == OP_ABS: return builtins.abs(args[0])
+    elif op == OP_SQUARE: return args[0] * args[0]
+    elif op == OP_FMA: return args[0] * args[1] + args[2]
+    elif op == OP_FLOOR: return float(math.floor(args[0]))
+    elif op == OP_MOD: return args[0] - args[1] * math.floor(args[0] / args[1])
     else: assert(False)
 
 class Node:
@@ -244,6 +269,40 @@ def mul(node1, node2): return Node.input(OP_MUL, [node1, node2])
 def div(node1, node2): return Node.input(OP_DIV, [node1, node2])
 def min(node1, node2): return Node.input(OP_MIN, [node1, node2])
 def max(node1, node2): return Node.input(OP_MAX, [node1, node2])
+def abs(node): return Node.input(OP_ABS, [node])
+def square(node): return Node.input(OP_SQUARE, [node])
+def fma(node1, node2, node3): return Node.input(OP_FMA, [node1, node2, node3])
+def floor(node): return Node.input(OP_FLOOR, [node])
+def mod(node1, node2): return Node.input(OP_MOD, [node1, node2])
+
+# Domain repetition : repeat a shape centred on the origin every period[k] along axis k
+# (a period of None means no repetition along that axis), infinitely many times.
+# The tape size doesn't depend on the number of copies. 
+# The shape should fit inside a period, otherwise the copies get cut.
+def repeat(shape, period):
+    assert(len(period) == 3)
+    def local(axis, p):
+        if p is None: return axis
+        return mod(axis + const(p / 2.0), const(p)) - const(p / 2.0)
+    return shape(local(X(), period[0]), local(Y(), period[1]), local(Z(), period[2]), T())
+
+# Bounded domain repetition : count[k] copies of the shape along axis k, 
+# centred at 0, period[k], ..., (count[k] - 1) * period[k].
+# Outside of the copies, the closest copy is used.
+def repeat_bounded(shape, period, count):
+    assert(len(period) == 3 and len(count) == 3)
+    def local(axis, p, n):
+        assert(n >= 1)
+        if n == 1: return axis
+        # The index of the closest copy, clamped to [0, n-1].
+        k = floor(axis / const(p) + const(0.5))
+        k = max(min(k, const(n - 1)), const(0))
+        return axis - const(p) * k
+    return shape(
+        local(X(), period[0], count[0]), 
+        local(Y(), period[1], count[1]), 
+        local(Z(), period[2], count[2]), 
+        T())
 
 # Merge the copies of each axis node
 def merge_axes(root):
@@ -319,4 +378,48 @@ def constant_fold(root):
             return node
         else: 
             return constant_fold_step(Node.input(node.op, inputs))
-    return root.topo_map(step)
\ No newline at end of file
+    return root.topo_map(step)
+
+# Count the number of times each node is used as an input in the DAG rooted at root.
+def use_counts(root):
+    counts = dict()
+    def step(node):
+        counts.setdefault(node, 0)
+        if is_input_op(node.op):
+            for inp in node.inputs:
+                counts[inp] += 1
+    root.topo_iter(step)
+    return counts
+
+# Peephole optimization : recognize some patterns and replace them 
+# with fused operators, which give shorter tapes and tighter interval bounds.
+# This should be called after merge_axes, so that x * x is recognized as a square.
+def fuse(root):
+    counts = use_counts(root)
+
+    # Is node a (rewritten) negation of other ?
+    def is_neg_of(node, other):
+        return node.op == OP_NEG and node[0] == other
+
+    # node is the original node, inputs are its rewritten inputs.
+    def step(node, inputs):
+        if not is_input_op(node.op): 
+            return node
+        # x * x -> square(x)
+        if node.op == OP_MUL and inputs[0] == inputs[1]:
+            return square(inputs[0])
+        # max(x, -x) -> abs(x)
+        if node.op == OP_MAX and (is_neg_of(inputs[0], inputs[1]) or is_neg_of(inputs[1], inputs[0])):
+            return abs(inputs[1] if is_neg_of(inputs[0], inputs[1]) else inputs[0])
+        # sqrt(x * x) -> abs(x)
+        if node.op == OP_SQRT and inputs[0].op == OP_SQUARE:
+            return abs(inputs[0][0])
+        # a * b + c -> fma(a, b, c), when a * b isn't used elsewhere.
+        # FMA accumulates into the slot of its addend, so there is no point 
+        # in fusing when the addend is a constant.
+        if node.op == OP_ADD:
+            for k in [0, 1]:
+                if inputs[k].op == OP_MUL and counts[node.inputs[k]] == 1 and inputs[1-k].op != OP_CONST:
+                    return fma(inputs[k][0], inputs[k][1], inputs[1-k])
+        return Node.input(node.op, inputs)
+    return root.topo_map(step)
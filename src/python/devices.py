@@ -0,0 +1,33 @@
+import pyopencl as cl
+
+from __engine import __engine
+
+
+# The engine binds to a single OpenCL device. To use several devices (or all the memory bandwidth
+# of a machine with several CPU sockets), we open one engine per device and spread the work
+# over them (see voxelize_tiled in chunks.py).
+
+# Open one engine per OpenCL device whose platform and device names contain 
+# platform_pref and device_pref (if they are given).
+# If numa is true, the CPU devices are split in one sub-device per NUMA node (when the platform supports it,
+# as pocl does) : the threads of each engine then stay on their node and use its memory bandwidth.
+def open_engines(platform_pref = None, device_pref = None, numa = False):
+    engines = []
+    for platform in cl.get_platforms():
+        if platform_pref is not None and platform.name.find(platform_pref) < 0:
+            continue
+        for device in platform.get_devices():
+            if device_pref is not None and device.name.find(device_pref) < 0:
+                continue
+            devices = [device]
+            if numa and device.type & cl.device_type.CPU:
+                try:
+                    devices = device.create_sub_devices(
+                        [cl.device_partition_property.BY_AFFINITY_DOMAIN, cl.device_affinity_domain.NUMA])
+                except cl.Error:
+                    # The platform can't split the device : we keep it whole.
+                    pass
+            for d in devices:
+                engines.append(__engine(command_queue = cl.CommandQueue(cl.Context(devices = [d]))))
+    assert(len(engines) > 0)
+    return engines
@@ -0,0 +1,94 @@
+import numpy as np
+
+import tape
+
+
+# A relocatable piece of tape, compiled once from a CSG expression and linked
+# into scene tapes any number of times (see link).
+# A fragment never overwrites the axis slots (0 to 3), so that several fragments
+# can run one after the other, and its output is left in out_slot.
+class Fragment:
+    def __init__(self, expr):
+        tap = tape.Tape(expr, pin_axes = True)
+        self.constant_pool = tap.constant_pool
+        self.slot_count = tap.slot_count
+        self.out_slot = tap.out_slot
+        self.instr_count = len(tap.instructions)
+
+        # Pre-decode the instructions so that relocating them is a few vectorized operations.
+        instrs = np.array(tap.instructions, dtype = np.uint32)
+        op_byte = (instrs >> 24) & 0xFF
+        # OP_CONST reads the constant pool through in_slotA : make sure it has the flag,
+        # so that the linked tape never reads in_slotA as a slot.
+        op_byte = np.where((op_byte & tape.OP_MASK) == tape.OP_CONST, op_byte | tape.FLAG_CONST_A, op_byte)
+        self.op_byte = op_byte
+        self.out_slot_arr = (instrs >> 16) & 0xFF
+        self.in_slotA = (instrs >> 8) & 0xFF
+        self.in_slotB = instrs & 0xFF
+        self.constA = (op_byte & tape.FLAG_CONST_A) != 0
+        self.constB = (op_byte & tape.FLAG_CONST_B) != 0
+
+    # Relocate the instructions : local slots 4 and above are shifted by slot_offset,
+    # and constant indices are renumbered with const_map (local index -> scene index).
+    def relocate(self, slot_offset, const_map):
+        def reloc_slot(s):
+            return np.where(s >= 4, s + slot_offset, s)
+        def reloc_input(s, const):
+            if len(const_map) == 0: return reloc_slot(s)
+            return np.where(const, const_map[np.minimum(s, len(const_map) - 1)], reloc_slot(s))
+        out_slot = reloc_slot(self.out_slot_arr)
+        in_slotA = reloc_input(self.in_slotA, self.constA)
+        in_slotB = reloc_input(self.in_slotB, self.constB)
+        assert(self.instr_count == 0 or max(out_slot.max(), in_slotA.max(), in_slotB.max()) < 256)
+        return (self.op_byte << 24) | (out_slot << 16) | (in_slotA << 8) | in_slotB
+
+    def reloc_out_slot(self, slot_offset):
+        return self.out_slot + slot_offset if self.out_slot >= 4 else self.out_slot
+
+
+# The scene tapes use slot 4 as an accumulator : the fragments run one after the other
+# in the slots above it, and each result is combined into the accumulator.
+ACC_SLOT = 4
+SLOT_OFFSET = 1
+
+# Add the constants of a fragment to a constant pool (a list and a dict value -> index).
+# This returns the map from the local constant indices to the indices in the pool.
+def add_constants(frag, constant_pool, constant_idx):
+    const_map = []
+    for c in frag.constant_pool:
+        if c not in constant_idx:
+            constant_idx[c] = len(constant_pool)
+            constant_pool.append(c)
+        const_map.append(constant_idx[c])
+    return np.array(const_map, dtype = np.uint32)
+
+# Put relocated fragments (bodies[k] is the relocated code of fragments[k]) together 
+# into a single tape, whose output is combinator applied to the outputs of all the fragments.
+def assemble(fragments, bodies, constant_pool, combinator):
+    assert(len(fragments) > 0)
+    assert(combinator in [tape.OP_MIN, tape.OP_MAX])
+    assert(len(constant_pool) <= 256)
+    chunks = []
+    for k, (frag, body) in enumerate(zip(fragments, bodies)):
+        chunks.append(body)
+        out = frag.reloc_out_slot(SLOT_OFFSET)
+        if k == 0: combine = tape.encode_instruction(tape.OP_COPY, ACC_SLOT, out, 0)
+        else:      combine = tape.encode_instruction(combinator, ACC_SLOT, ACC_SLOT, out)
+        chunks.append(np.array([combine], dtype = np.uint32))
+    chunks.append(np.array([tape.encode_instruction(tape.OP_COPY, 0, ACC_SLOT, 0)], dtype = np.uint32))
+    instructions = np.concatenate(chunks)
+
+    slot_count = max(ACC_SLOT + 1, max(frag.slot_count for frag in fragments) + SLOT_OFFSET)
+    assert(slot_count <= 256)
+    return tape.Tape.from_instructions(instructions.tolist(), constant_pool, slot_count)
+
+# Link fragments into a single tape, whose output is combinator (tape.OP_MIN for a union,
+# tape.OP_MAX for an intersection) applied to the outputs of all the fragments.
+def link(fragments, combinator = tape.OP_MIN):
+    constant_pool = []
+    constant_idx = dict()
+    bodies = []
+    for frag in fragments:
+        const_map = add_constants(frag, constant_pool, constant_idx)
+        bodies.append(frag.relocate(SLOT_OFFSET, const_map))
+    return assemble(fragments, bodies, constant_pool, combinator)
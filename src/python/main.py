@@ -4,6 +4,7 @@ import pygame
 from utils import MovingAverage
 import csg
 import tape
+import clipmap
 from __engine import __engine
 
 
@@ -14,6 +15,35 @@ FOV_RAD = np.deg2rad(70)
 # The move speed of the camera, in world unit per second
 CAM_MOVE_SPEED = 5
 MAX_FPS = 120
+# The dimensions of the levels of the voxel hierarchy (see build_voxels in voxelizer.fut).
+VOXEL_DIMS = (16, 4, 4)
+# Pack the voxel masks (or the bricks) in Morton order, which is friendlier to the cache
+# when rays cross the nodes along x or y (see mask_layout in voxelizer.fut). The dims should be powers of two.
+MORTON_LAYOUT = False
+# Use a brick map instead (see brickmap.fut) : a coarse grid and the dimension of the bricks.
+# Memory scales with the area of the surface, so higher resolutions fit.
+USE_BRICKS = False
+BRICK_DIMS = (64, 8)
+# Only voxelize the bricks the camera sees, and the new ones when it moves.
+USE_FRUSTUM = False
+# Or bake a narrow band of densities (see sdf.fut) : the coarse grid, the samples per brick side 
+# and the range of the densities. Rendering the band doesn't evaluate the tape.
+USE_SDF = False
+SDF_DIMS = (64, 9)
+SDF_BAND = 10.0
+# A bound on the slope of the baked densities, so that rays skip the cells far from the surface. 
+# The partial derivatives of the sphere below are at most 2 * 10 in the frame, and so are the ones
+# of the trilinear density up to the quantization : its gradient is shorter than 20 * sqrt(3) < 40.
+SDF_LIPSCHITZ = 40.0
+# Or keep a clipmap around the camera (see clipmap.fut) for worlds larger than the frame : 
+# the number of levels, the voxels per level side and the size of the cells of the first level.
+# Only the slabs that enter the levels are voxelized when the camera moves.
+USE_CLIPMAP = False
+CLIPMAP_DIMS = (5, 128)
+CLIPMAP_CELL_SIZE = 0.05
+# The position (of the lower corner) and size of the cube that contains the voxels.
+FRAME_POS = (-10.0, -10.0, -10.0)
+FRAME_SIZE = 20.0
 WHITE = (255, 255, 255)
 
 def main():
@@ -39,6 +69,14 @@ def main():
     tap = tape.Tape(expr)
     print(tap.to_string(detailed = True))
 
+    # The voxels stay on the GPU between frames : 
+    # we only voxelize again when the tape changes.
+    voxels = None
+    voxels_tape = None
+    voxels_tape_args = None
+    voxels_origins = None
+    voxels_cam = None
+
     run = True
     clock = pygame.time.Clock()
     ma = MovingAverage(30)
@@ -66,14 +104,45 @@ def main():
         if keys[pygame.K_RSHIFT]:
             cam_pos += delta_t * CAM_MOVE_SPEED * cam_up 
 
+        if USE_CLIPMAP:
+            origins = clipmap.level_origins(cam_pos, CLIPMAP_DIMS[0], CLIPMAP_DIMS[1], CLIPMAP_CELL_SIZE)
+        if voxels_tape is not tap:
+            voxels_tape = tap
+            voxels_tape_args = tape.tape_args(tap)
+            if USE_CLIPMAP:
+                voxels = fut.voxelize_clipmap(CLIPMAP_DIMS[1], CLIPMAP_CELL_SIZE, origins, 0.0, *voxels_tape_args)
+                voxels_origins = origins
+            elif USE_SDF:
+                voxels = fut.bake_sdf(*SDF_DIMS, SDF_BAND, 0.0, *FRAME_POS, FRAME_SIZE, *voxels_tape_args)
+            elif USE_BRICKS and USE_FRUSTUM:
+                voxels = fut.voxelize_bricks_frustum(*BRICK_DIMS, MORTON_LAYOUT, 0.0, *FRAME_POS, FRAME_SIZE, 
+                    WIDTH, HEIGHT, *cam_pos, *cam_forward, *cam_right, *cam_up, FOV_RAD, *voxels_tape_args)
+                voxels_cam = cam_pos.copy()
+            elif USE_BRICKS:
+                voxels = fut.voxelize_bricks(*BRICK_DIMS, MORTON_LAYOUT, 0.0, *FRAME_POS, FRAME_SIZE, *voxels_tape_args)
+            else:
+                voxels = fut.voxelize(*VOXEL_DIMS, MORTON_LAYOUT, 0.0, *FRAME_POS, FRAME_SIZE, *voxels_tape_args)
+        elif USE_CLIPMAP and not np.array_equal(origins, voxels_origins):
+            voxels = fut.move_clipmap(voxels, origins, 0.0, *voxels_tape_args)
+            voxels_origins = origins
+        elif USE_BRICKS and USE_FRUSTUM and not np.array_equal(cam_pos, voxels_cam):
+            voxels = fut.reveal_bricks(0.0, voxels, 
+                WIDTH, HEIGHT, *cam_pos, *cam_forward, *cam_right, *cam_up, FOV_RAD, *voxels_tape_args)
+            voxels_cam = cam_pos.copy()
+
         # Raytrace the image
         t0 = pygame.time.get_ticks()
-        raw_img = fut.main(
-            WIDTH, HEIGHT, 
-            *cam_pos, *cam_forward, *cam_right, *cam_up, FOV_RAD,
-            np.array(tap.instructions, dtype = np.uint32), 
-            np.array(tap.constant_pool, dtype = np.float32),
-            tap.slot_count).get()
+        if USE_SDF:
+            raw_img = fut.render_sdf(
+                WIDTH, HEIGHT, 
+                *cam_pos, *cam_forward, *cam_right, *cam_up, FOV_RAD,
+                voxels, SDF_LIPSCHITZ).get()
+        else:
+            render = fut.render_clipmap if USE_CLIPMAP else fut.render_bricks if USE_BRICKS else fut.render
+            raw_img = render(0.0,
+                WIDTH, HEIGHT, 
+                *cam_pos, *cam_forward, *cam_right, *cam_up, FOV_RAD,
+                voxels, *voxels_tape_args).get()
         t1 = pygame.time.get_ticks()
         ma.add_sample(t1 - t0)
         # For pygame, the first axis is horizontal from left to right
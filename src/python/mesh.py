@@ -0,0 +1,132 @@
+import shutil
+import tempfile
+import numpy as np
+
+import batch
+import tape
+import values
+
+
+# Extract triangle meshes of the surface and stream them to PLY or OBJ files.
+# The frame is split in blocks that are meshed one after the other by the engine
+# (see mesh.fut), and the arrays of each block are written to the file as soon as they are ready :
+# large grids (1024^3 and up) never have to fit in memory, and no Python lists are built.
+
+# The binary PLY layout of a triangle : the vertex count and the indices of the vertices.
+PLY_FACE = np.dtype([('count', 'u1'), ('indices', '<i4', 3)])
+
+# A binary PLY file. The counts in the header are only known at the end :
+# they have a fixed width, and we write the header again when the file is closed.
+# The triangles have to come after all the vertices, so they go to a temporary file first.
+class PlyWriter:
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.faces = tempfile.TemporaryFile()
+        self.vertex_count = 0
+        self.face_count = 0
+        self.write_header()
+
+    def write_header(self):
+        header = (
+            "ply\n"
+            "format binary_little_endian 1.0\n"
+            "element vertex %010d\n"
+            "property float x\n"
+            "property float y\n"
+            "property float z\n"
+            "element face %010d\n"
+            "property list uchar int vertex_indices\n"
+            "end_header\n") % (self.vertex_count, self.face_count)
+        self.file.seek(0)
+        self.file.write(header.encode("ascii"))
+
+    # Add a mesh : the triangles index the vertices of this mesh.
+    def write(self, vertices, triangles):
+        faces = np.empty(len(triangles), dtype = PLY_FACE)
+        faces['count'] = 3
+        faces['indices'] = triangles + self.vertex_count
+        self.file.write(np.ascontiguousarray(vertices, dtype = '<f4').tobytes())
+        self.faces.write(faces.tobytes())
+        self.vertex_count += len(vertices)
+        self.face_count += len(triangles)
+
+    def close(self):
+        self.faces.seek(0)
+        shutil.copyfileobj(self.faces, self.file)
+        self.faces.close()
+        self.write_header()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# A text OBJ file. The vertices and triangles of each mesh are written right away.
+class ObjWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.vertex_count = 0
+        self.face_count = 0
+
+    # Add a mesh : the triangles index the vertices of this mesh.
+    def write(self, vertices, triangles):
+        np.savetxt(self.file, vertices, fmt = "v %.6f %.6f %.6f")
+        # OBJ indices start at 1.
+        np.savetxt(self.file, triangles + (self.vertex_count + 1), fmt = "f %d %d %d")
+        self.vertex_count += len(vertices)
+        self.face_count += len(triangles)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Extract a mesh of the surface at time t on a grid of dim^3 cells over the frame,
+# and stream it to the file at path (.ply or .obj). The grid is meshed in blocks of block_dim^3 cells
+# (dim should be a multiple of block_dim), with dual contouring if dual is true
+# and with marching tetrahedra otherwise. The blocks that interval arithmetic proves
+# to be completely inside or outside are skipped.
+# The vertices on the faces between blocks are duplicated. This returns the vertex and triangle counts.
+# If sdf is a narrow band baked by bake_sdf from the same tape at time t over the same frame,
+# the blocks are meshed from the baked densities with marching tetrahedra : the tape only skips blocks.
+def extract_mesh(fut, tap, path, dim, frame_pos, frame_size, t = 0.0, block_dim = 128, dual = False, sdf = None):
+    assert(dim % block_dim == 0)
+    assert(path.endswith(".ply") or path.endswith(".obj"))
+    assert(sdf is None or not dual)
+    extract = fut.mesh_dual_contouring if dual else fut.mesh_marching_tetrahedra
+    args = tape.tape_args(tap)
+    cell_size = frame_size / dim
+    block_size = cell_size * block_dim
+    block_count = dim // block_dim
+    # Bound all the blocks in one batch. Dual contouring also samples one cell around the block.
+    bs = np.indices((block_count,) * 3).reshape(3, -1)
+    lows = [frame_pos[k] + block_size * bs[k] for k in range(3)]
+    with batch.BatchEvaluator(tap) as evaluator:
+        bounds = evaluator.eval_bounds(
+            *[values.Intervals(low - cell_size, low + block_size + cell_size) for low in lows], t)
+
+    writer = PlyWriter(path) if path.endswith(".ply") else ObjWriter(path)
+    with writer:
+        # The device computes asynchronously : we launch the next block
+        # before waiting for the previous one, so that writing overlaps with meshing.
+        pending = None
+        for i in range(bs.shape[1]):
+            if bounds.low[i] > 0.0 or bounds.high[i] <= 0.0:
+                continue
+            pos = [frame_pos[k] + block_size * int(bs[k, i]) for k in range(3)]
+            if sdf is not None:
+                mesh = fut.mesh_sdf(block_dim, *pos, cell_size, sdf)
+            else:
+                mesh = extract(block_dim, t, *pos, cell_size, *args)
+            if pending is not None:
+                writer.write(*[a.get() for a in pending])
+            pending = mesh
+        if pending is not None:
+            writer.write(*[a.get() for a in pending])
+    return writer.vertex_count, writer.face_count
@@ -0,0 +1,136 @@
+import csg
+
+
+# Polynomials in the axes X, Y, Z and T are represented as dicts
+# that map exponent tuples (i, j, k, l) to coefficients :
+# { (2, 0, 0, 0) : 1.0, (0, 0, 0, 0) : -4.0 } is X*X - 4.
+AXIS_OPS = [csg.OP_X, csg.OP_Y, csg.OP_Z, csg.OP_T]
+ZERO_EXPS = (0, 0, 0, 0)
+
+# We don't expand polynomials that get too big.
+MAX_DEGREE = 12
+MAX_TERMS = 64
+
+def poly_add(p, q, scale = 1.0):
+    res = dict(p)
+    for e, c in q.items():
+        res[e] = res.get(e, 0.0) + scale * c
+    return { e : c for e, c in res.items() if c != 0.0 }
+
+def poly_mul(p, q):
+    res = dict()
+    for e1, c1 in p.items():
+        for e2, c2 in q.items():
+            e = tuple(a + b for a, b in zip(e1, e2))
+            res[e] = res.get(e, 0.0) + c1 * c2
+    return { e : c for e, c in res.items() if c != 0.0 }
+
+def poly_degree(p):
+    return max([sum(e) for e in p.keys()], default = 0)
+
+# Is the node a square ? After merge_axes, x * x has the same node twice.
+def is_square(node):
+    return node.op == csg.OP_SQUARE or (node.op == csg.OP_MUL and node[0] == node[1])
+
+# Compute the polynomial of every node in the DAG rooted at root,
+# or None for the nodes that are not polynomials.
+# The squares of polynomials with several terms, such as (x - a)^2, are not polynomials here :
+# the interval of a square is exact, and expanding it gives much wider intervals.
+def node_polys(root):
+    polys = dict()
+    def step(node):
+        args = [polys[i] for i in node.inputs] if csg.is_input_op(node.op) else []
+        if any(a is None for a in args):
+            polys[node] = None
+            return
+        p = None
+        if node.op in AXIS_OPS:
+            e = [0, 0, 0, 0]
+            e[AXIS_OPS.index(node.op)] = 1
+            p = { tuple(e) : 1.0 }
+        elif node.op == csg.OP_CONST: p = { ZERO_EXPS : node.constant } if node.constant != 0.0 else dict()
+        elif node.op == csg.OP_NEG: p = poly_add(dict(), args[0], -1.0)
+        elif node.op == csg.OP_ADD: p = poly_add(args[0], args[1])
+        elif node.op == csg.OP_SUB: p = poly_add(args[0], args[1], -1.0)
+        elif node.op == csg.OP_MUL: p = poly_mul(args[0], args[1])
+        elif node.op == csg.OP_SQUARE: p = poly_mul(args[0], args[0])
+        elif node.op == csg.OP_FMA: p = poly_add(poly_mul(args[0], args[1]), args[2])
+        elif node.op == csg.OP_DIV and node[1].op == csg.OP_CONST and node[1].constant != 0.0:
+            p = poly_add(dict(), args[0], 1.0 / node[1].constant)
+        if p is not None and (len(p) > MAX_TERMS or poly_degree(p) > MAX_DEGREE):
+            p = None
+        if is_square(node) and len(args[0]) > 1:
+            p = None
+        polys[node] = p
+    root.topo_iter(step)
+    return polys
+
+# Build v^k with as few multiplications as possible (and squares, which have exact intervals).
+def power(v, k):
+    assert(k >= 1)
+    if k == 1: return v
+    half = csg.square(power(v, k // 2))
+    return half * v if k % 2 == 1 else half
+
+# Build a CSG expression that evaluates the polynomial in Horner form,
+# one axis after the other : p = (...(q_n * x^(n-m) + q_m) * x^(...) + ...) where the q_i
+# are polynomials in the remaining axes, themselves in Horner form.
+def horner(p, axes, var = 0):
+    if var == len(AXIS_OPS) or all(e[var:] == ZERO_EXPS[var:] for e in p.keys()):
+        return csg.const(p.get(ZERO_EXPS, 0.0))
+    # Group the terms by power of the current axis.
+    groups = dict()
+    for e, c in p.items():
+        rest = e[:var] + (0,) + e[var+1:]
+        groups.setdefault(e[var], dict())[rest] = c
+    powers = sorted(groups.keys(), reverse = True)
+
+    simplify = csg.constant_fold_step
+    acc = horner(groups[powers[0]], axes, var + 1)
+    for prev, curr in zip(powers, powers[1:]):
+        acc = simplify(acc * power(axes[var], prev - curr))
+        acc = simplify(acc + horner(groups[curr], axes, var + 1))
+    if powers[-1] > 0:
+        acc = simplify(acc * power(axes[var], powers[-1]))
+    return acc
+
+# The number of tape instructions needed to evaluate the DAG rooted at node
+# (before fusing operators).
+def instr_count(node):
+    count = 0
+    def step(n):
+        nonlocal count
+        if csg.is_input_op(n.op): count += 1
+    node.topo_iter(step)
+    return count
+
+# Replace the polynomial subtrees with their Horner form, when this needs fewer instructions.
+# Naive products such as x*x*x*x + 3*x*x*x + ... get much shorter.
+# Interval arithmetic can be wider on the Horner form : the voxelizer bounds the small cells
+# with the centered form (see centered_form in tape.fut), which gives nearly the same bounds on both forms.
+# This should be called after merge_axes.
+def hornerize(root):
+    polys = node_polys(root)
+    # Get the axis nodes
+    axes = [None, None, None, None]
+    def find_axes(node):
+        if node.op in AXIS_OPS: axes[AXIS_OPS.index(node.op)] = node
+    root.topo_iter(find_axes)
+
+    # A polynomial node is maximal if it is the root or if some non-polynomial node uses it.
+    maximal = { root }
+    def find_maximal(node):
+        if csg.is_input_op(node.op) and polys[node] is None:
+            for inp in node.inputs:
+                maximal.add(inp)
+    root.topo_iter(find_maximal)
+
+    def step(node, inputs):
+        if not csg.is_input_op(node.op):
+            return node
+        if node in maximal and polys[node] is not None:
+            h = horner(polys[node], axes)
+            if instr_count(h) < instr_count(node):
+                return h
+        return csg.Node.input(node.op, inputs)
+    return root.topo_map(step)
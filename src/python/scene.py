@@ -0,0 +1,142 @@
+import numpy as np
+
+import batch
+import csg
+import tape
+import linker
+import values
+
+
+# An editable scene : the union (or intersection) of many parts, compiled incrementally.
+# Each part is compiled into a relocatable fragment (see linker.py) the first time it is seen.
+# When the scene is updated, only the parts whose DAG changed are compiled again,
+# and the instruction stream and constant pool of the scene tape are patched.
+class Scene:
+    def __init__(self, combinator = tape.OP_MIN):
+        assert(combinator in [tape.OP_MIN, tape.OP_MAX])
+        self.combinator = combinator
+        # The root node of each part, in order.
+        self.parts = []
+        # The compiled fragment and relocated instructions of each part, indexed by root node.
+        self.fragments = dict()
+        self.bodies = dict()
+        # The constant pool of the scene tape. It only grows between full relinks,
+        # so that the relocated instructions of the parts stay valid.
+        self.constant_pool = []
+        self.constant_idx = dict()
+        # Statistics about the last update.
+        self.compiled_count = 0
+        self.relinked = False
+        # The parts that were added or removed in the last update.
+        self.changed_parts = []
+
+    # Split an expression into parts along the combinator :
+    # min(min(a, b), c) has the parts a, b and c for a union.
+    def split_parts(self, expr):
+        csg_op = csg.OP_MIN if self.combinator == tape.OP_MIN else csg.OP_MAX
+        parts = []
+        stack = [expr]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.op == csg_op:
+                stack.append(node[1])
+                stack.append(node[0])
+            else:
+                parts.append(node)
+        return parts
+
+    # Relocate a fragment against the scene constant pool.
+    # This returns None if the constant pool is full.
+    def relocate(self, frag):
+        const_map = linker.add_constants(frag, self.constant_pool, self.constant_idx)
+        if len(self.constant_pool) > 256:
+            return None
+        return frag.relocate(linker.SLOT_OFFSET, const_map)
+
+    # Rebuild the constant pool from scratch, keeping only the constants that are still used,
+    # and relocate all the fragments again. The fragments are NOT recompiled.
+    def relink(self):
+        self.constant_pool = []
+        self.constant_idx = dict()
+        self.bodies = dict()
+        for part in self.parts:
+            if part not in self.bodies:
+                self.bodies[part] = self.relocate(self.fragments[part])
+                assert(self.bodies[part] is not None)
+        self.relinked = True
+
+    # Set the new scene expression. Parts that are the same node as in the previous scene
+    # (or in the same update) are reused, so edits should build new nodes only for what changed.
+    def update(self, expr):
+        self.parts = self.split_parts(expr)
+        self.compiled_count = 0
+        self.relinked = False
+
+        # Compile and relocate the new parts, and forget the parts that are gone.
+        fragments = dict()
+        bodies = dict()
+        for part in self.parts:
+            if part in fragments: continue
+            if part in self.fragments:
+                fragments[part] = self.fragments[part]
+                bodies[part] = self.bodies[part]
+            else:
+                fragments[part] = linker.Fragment(part)
+                bodies[part] = self.relocate(fragments[part])
+                self.compiled_count += 1
+        removed = [part for part in self.fragments if part not in fragments]
+        added = [part for part in fragments if part not in self.fragments]
+        self.changed_parts = added + removed
+        self.fragments = fragments
+        self.bodies = bodies
+
+        # Only relocate everything if we ran out of constants.
+        if any(body is None for body in self.bodies.values()):
+            self.relink()
+
+    # Get the tape for the current scene.
+    def tape(self):
+        assert(len(self.parts) > 0)
+        fragments = [self.fragments[part] for part in self.parts]
+        bodies = [self.bodies[part] for part in self.parts]
+        return linker.assemble(fragments, bodies, self.constant_pool, self.combinator)
+
+    # The coarse cells of a grid (c^3 cells over the frame) where the inside of the scene
+    # may have changed in the last update, as an array of booleans (see update_bricks in dda.fut).
+    # A part can only change a union where the part itself may be inside, 
+    # and an intersection where it may be outside : we find these cells for the added
+    # and removed parts by splitting the frame recursively and bounding the parts with intervals.
+    # The boxes of each level of the splitting are bounded in one batch.
+    # This scales with the size of the edit, not with the size of the scene.
+    def dirty_cells(self, c, frame_pos, frame_size, t = 0.0):
+        dirty = np.zeros((c, c, c), dtype = bool)
+        cell_size = frame_size / c
+        for part in self.changed_parts:
+            tap = tape.Tape(part)
+            with batch.BatchEvaluator(tap) as evaluator:
+                # Ranges of cells [lo, hi) along each axis.
+                boxes = [((0, 0, 0), (c, c, c))]
+                while len(boxes) > 0:
+                    los = np.array([lo for lo, _ in boxes]).T
+                    his = np.array([hi for _, hi in boxes]).T
+                    bounds = evaluator.eval_bounds(*[values.Intervals(
+                        frame_pos[k] + cell_size * los[k], frame_pos[k] + cell_size * his[k]) for k in range(3)], t)
+                    splits = []
+                    for (lo, hi), low, high in zip(boxes, bounds.low, bounds.high):
+                        # We are careful with NaN bounds.
+                        if self.combinator == tape.OP_MIN:
+                            may_change, covered = not (low > 0.0), high <= 0.0
+                        else:
+                            may_change, covered = not (high <= 0.0), low > 0.0
+                        if not may_change: 
+                            continue
+                        if covered or all(hi[k] - lo[k] == 1 for k in range(3)):
+                            dirty[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]] = True
+                            continue
+                        # Split the longest axis in two.
+                        k = max(range(3), key = lambda k : hi[k] - lo[k])
+                        mid = (lo[k] + hi[k]) // 2
+                        splits.append((lo, hi[:k] + (mid,) + hi[k+1:]))
+                        splits.append((lo[:k] + (mid,) + lo[k+1:], hi))
+                    boxes = splits
+        return dirty
@@ -1,5 +1,8 @@
+import numpy as np
+
 import csg
-import math
+import poly
+import values
 
 
 # The set of tape operators is not exactly the same as the set of csg operators
@@ -19,6 +22,17 @@ OP_DIV = 9
 OP_MIN = 10
 OP_MAX = 11
 OP_COPY = 12
+# Fused operators (see csg.fuse)
+OP_SQUARE = 13
+OP_ABS = 14
+# Ternary operator : out = A * B + out
+OP_FMA = 15
+# Repetition operators
+OP_FLOOR = 16
+OP_MOD = 17
+
+# The operators that read their second input (FMA also reads its output slot).
+BINARY_OPS = [OP_ADD, OP_SUB, OP_MUL, OP_DIV, OP_MIN, OP_MAX, OP_FMA, OP_MOD]
 
 def op_to_string(op):
     if   op == OP_CONST: return "CONST"
@@ -34,22 +48,37 @@ def op_to_string(op):
     elif op == OP_MIN: return "MIN"
     elif op == OP_MAX: return "MAX"
     elif op == OP_COPY: return "COPY"
+    elif op == OP_SQUARE: return "SQUARE"
+    elif op == OP_ABS: return "ABS"
+    elif op == OP_FMA: return "FMA"
+    elif op == OP_FLOOR: return "FLOOR"
+    elif op == OP_MOD: return "MOD"
     else: assert(False)
 
 # Each instruction is incoded in a 32-bits unsigned integer. 
-def encode_instruction(op, out_slot, in_slotA, in_slotB):
-    assert(type(op) == int and 0 <= op < 256)
+# The two high bits of the operator byte flag the inputs that are immediate constants :
+# the corresponding input index is then an index in the constant pool rather than a slot.
+FLAG_CONST_A = 0x80
+FLAG_CONST_B = 0x40
+OP_MASK = 0x3F
+
+def encode_instruction(op, out_slot, in_slotA, in_slotB, constA = False, constB = False):
+    assert(type(op) == int and 0 <= op <= OP_MASK)
     assert(type(out_slot) == int and 0 <= out_slot < 256)
     assert(type(in_slotA) == int and 0 <= in_slotA < 256)
     assert(type(in_slotB) == int and 0 <= in_slotB < 256)
+    if constA: op |= FLAG_CONST_A
+    if constB: op |= FLAG_CONST_B
     return (op << 24) | (out_slot << 16) | (in_slotA << 8)  | (in_slotB << 0)
 
 def decode_instruction(instr):
-    op       = (instr >> 24) & 0xFF
+    op       = (instr >> 24) & OP_MASK
+    constA   = ((instr >> 24) & FLAG_CONST_A) != 0
+    constB   = ((instr >> 24) & FLAG_CONST_B) != 0
     out_slot = (instr >> 16) & 0xFF
     in_slotA = (instr >> 8)  & 0xFF
     in_slotB = (instr >> 0)  & 0xFF
-    return op, out_slot, in_slotA, in_slotB
+    return op, out_slot, in_slotA, in_slotB, constA, constB
     
 # This function only works if [op] corresponds to a tape instruction.
 # For instance axis operators don't.
@@ -67,19 +96,48 @@ def tape_op_from_csg_op(op):
     elif op == csg.OP_DIV: return OP_DIV
     elif op == csg.OP_MIN: return OP_MIN
     elif op == csg.OP_MAX: return OP_MAX
+    elif op == csg.OP_SQUARE: return OP_SQUARE
+    elif op == csg.OP_ABS: return OP_ABS
+    elif op == csg.OP_FMA: return OP_FMA
+    elif op == csg.OP_FLOOR: return OP_FLOOR
+    elif op == csg.OP_MOD: return OP_MOD
     else: assert(False)
 
 class Tape:
-    # Build a tape from a CSG expression
-    def __init__(self, expr):
+    # Build a tape from a CSG expression.
+    # If pin_axes is set, the instructions never overwrite the axis slots (0 to 3) 
+    # and the output is left in out_slot instead of slot 0 : this is used to build 
+    # relocatable fragments (see linker.py).
+    def __init__(self, expr, pin_axes = False):
+        self.pin_axes = pin_axes
+
         # Make sure there is at most one copy of each axis node.
         expr = csg.merge_axes(expr)
+        # Evaluate polynomials in Horner form when it is shorter.
+        expr = poly.hornerize(expr)
+        # Replace some patterns with fused operators.
+        expr = csg.fuse(expr)
 
         # Do a topological sort of the CSG expression :
         # each node appears after its inputs in the list
         self.nodes = []
         expr.topo_iter(lambda e: self.nodes.append(e))
 
+        # Sort the nodes by axis level : 0 for the nodes that only depend on x and t, 
+        # 1 for the nodes that depend on y but not z, 2 for the nodes that depend on z.
+        # The voxelizer runs the instructions of level 0 once per x coordinate, 
+        # those of level 1 once per (x, y) and only the others once per cell.
+        # The sort is stable and a node has at least the level of its inputs,
+        # so this is still a topological sort.
+        self.axis_level = dict()
+        for node in self.nodes:
+            if node.op == csg.OP_Y: self.axis_level[node] = 1
+            elif node.op == csg.OP_Z: self.axis_level[node] = 2
+            elif csg.is_input_op(node.op): 
+                self.axis_level[node] = max(self.axis_level[inp] for inp in node.inputs)
+            else: self.axis_level[node] = 0
+        self.nodes.sort(key = lambda node: self.axis_level[node])
+
         # Calculate the index in the sort of each node
         self.node_idx = dict()
         for i, node in enumerate(self.nodes):
@@ -93,16 +151,19 @@ class Tape:
                 self.constant_idx[node.constant] = len(self.constant_pool)
                 self.constant_pool.append(node.constant)
 
-        # Compute the liveliness of each node (except the root)
+        # Compute the liveliness of each node (except the root and the constants)
         # The liveliness of a node is the index of the last node that uses it as input.
+        # Constants don't need a liveliness : they are read directly from the constant pool 
+        # by the instructions that use them, and never occupy a slot.
         self.liveliness = dict()
         for i, node in enumerate(self.nodes):
             if csg.is_input_op(node.op):
                 for inp in node.inputs:
-                    self.liveliness[inp] = i
-        # Check every node except the root has a liveliness
+                    if inp.op != csg.OP_CONST:
+                        self.liveliness[inp] = i
+        # Check every node except the root and the constants has a liveliness
         for node in self.nodes:
-            assert(node == expr or node in self.liveliness.keys())
+            assert(node == expr or node.op == csg.OP_CONST or node in self.liveliness.keys())
 
         # Build the instructions
         self.instructions = []
@@ -117,8 +178,11 @@ class Tape:
             if node.op == csg.OP_Z: z = node
             if node.op == csg.OP_T: t = node
 
-        # Initially, the axis nodes occupy the first slots
-        slots = [x, y, z, t]
+        # Initially, the axis nodes occupy the first slots.
+        # The slots of the missing axes are reserved : the voxelizer writes to the y and z slots
+        # between the axis levels, so these slots must not hold anything else.
+        RESERVED = "reserved"
+        slots = [RESERVED if a is None else a for a in [x, y, z, t]]
 
         # Gets the index of the slot a node currently is stored in.
         def get_curr_slot(node):
@@ -130,34 +194,63 @@ class Tape:
         # Returns the index of a free slot.
         # Creates a new slot if none is free.
         def get_free_slot():
-            for i in range(len(slots)):
+            for i in range(4 if self.pin_axes else 0, len(slots)):
                 if slots[i] is None:
                     return i
             slots.append(None)
             return len(slots) - 1
 
         # Process each instruction in topological order
+        root = self.nodes[-1]
         for i, node in enumerate(self.nodes):
             if csg.is_axis_op(node.op): continue
+            # Constants don't get an instruction : they are immediate inputs of the nodes that use them.
+            # The only exception is when the whole expression is a constant.
+            if node.op == csg.OP_CONST and node != root: continue
             
-            # Compute the input slots of the node
-            in_slotA = 0
-            in_slotB = 0
+            # Compute the input slots of the node.
+            # A constant input is encoded as its index in the constant pool.
+            # The third input of FMA is handled separately.
+            in_slots = [0, 0]
+            in_consts = [False, False]
             if node.op == csg.OP_CONST:
-                in_slotA = self.constant_idx[node.constant]
-            elif csg.op_arity(node.op) == 1:
-                in_slotA = get_curr_slot(node[0])
-            elif csg.op_arity(node.op) == 2:
-                in_slotA = get_curr_slot(node[0])
-                in_slotB = get_curr_slot(node[1])
-            else: 
-                assert(False)
+                in_slots[0] = self.constant_idx[node.constant]
+                in_consts[0] = True
+            else:
+                assert(1 <= csg.op_arity(node.op) <= 3)
+                for k, inp in enumerate(node.inputs[:2]):
+                    if inp.op == csg.OP_CONST:
+                        in_slots[k] = self.constant_idx[inp.constant]
+                        in_consts[k] = True
+                    else:
+                        in_slots[k] = get_curr_slot(inp)
+
+            # FMA accumulates into its output slot : 
+            # the addend has to be in the output slot before the instruction runs.
+            if node.op == csg.OP_FMA:
+                addend = node[2]
+                if addend.op != csg.OP_CONST and self.liveliness[addend] == i and \
+                    not (self.pin_axes and csg.is_axis_op(addend.op)):
+                    # The addend dies here : accumulate directly in its slot.
+                    out_slot = get_curr_slot(addend)
+                else:
+                    # Otherwise copy the addend to a new slot. 
+                    # We do this BEFORE freeing the inputs so that the copy can't overwrite them.
+                    out_slot = get_free_slot()
+                    if addend.op == csg.OP_CONST:
+                        copy = encode_instruction(OP_CONST, out_slot, self.constant_idx[addend.constant], 0, True)
+                    else:
+                        copy = encode_instruction(OP_COPY, out_slot, get_curr_slot(addend), 0)
+                    self.instructions.append(copy)
+                    slots[out_slot] = node
 
             # Free the slots of the inputs if we can.
             # We have to be careful if the node's two inputs are the same.
             if csg.is_input_op(node.op):
                 to_free = []
                 for inp in node.inputs:
+                    if inp.op == csg.OP_CONST: continue
+                    if self.pin_axes and csg.is_axis_op(inp.op): continue
                     assert(self.liveliness[inp] >= i)
                     if self.liveliness[inp] == i:
                         to_free.append(get_curr_slot(inp))
@@ -166,58 +259,164 @@ class Tape:
             
             # Get a slot for the output (we do this AFTER freeing the inputs)
             # to enable reading and writing to the same slot
-            out_slot = get_free_slot()
+            if node.op != csg.OP_FMA:
+                out_slot = get_free_slot()
             slots[out_slot] = node
 
             # Encode the instruction
-            instr = encode_instruction(tape_op_from_csg_op(node.op), out_slot, in_slotA, in_slotB)
+            instr = encode_instruction(tape_op_from_csg_op(node.op), out_slot, 
+                in_slots[0], in_slots[1], in_consts[0], in_consts[1])
             self.instructions.append(instr)
 
-        # Check the last instruction outputs to slot 0
-        _, out_slot, _, _ = decode_instruction(self.instructions[-1])
-        assert(out_slot == 0)
+        # The output has to end up in slot 0. This is always the case
+        # except if the root is an FMA (which writes to the slot of its addend) or an axis.
+        # Relocatable fragments leave their output wherever it is.
+        root_slot = get_curr_slot(root)
+        if root_slot != 0 and not self.pin_axes:
+            self.instructions.append(encode_instruction(OP_COPY, 0, root_slot, 0))
+            root_slot = 0
+        self.out_slot = root_slot
 
         # Store the total number of slots for future use
         self.slot_count = len(slots)
 
+    # Build a tape directly from its instructions, constant pool and slot count,
+    # for instance the output of the linker. The output has to be in slot 0.
+    @classmethod
+    def from_instructions(cls, instructions, constant_pool, slot_count):
+        tap = cls.__new__(cls)
+        tap.pin_axes = False
+        tap.instructions = list(instructions)
+        tap.constant_pool = list(constant_pool)
+        tap.slot_count = slot_count
+        tap.out_slot = 0
+        return tap
+
     def to_string(self, detailed = False):
+        # Immediate constant inputs are printed as c<index in the constant pool>
+        def input_to_string(slot, const):
+            return ("c%u" % slot) if const else ("%u" % slot)
+
         str = "[+] Tape: instr_count=%u slot_count=%u\n" % (len(self.instructions), self.slot_count)
         if detailed:
             for i, instr in enumerate(self.instructions):
-                op, out_slot, in_slotA, in_slotB = decode_instruction(instr)
-                str += "\t%2u %10s  out=%2u  inA=%2u  inB=%2u\n" % \
-                    (i, op_to_string(op), out_slot, in_slotA, in_slotB)
+                op, out_slot, in_slotA, in_slotB, constA, constB = decode_instruction(instr)
+                str += "\t%2u %10s  out=%2u  inA=%3s  inB=%3s\n" % \
+                    (i, op_to_string(op), out_slot, 
+                     input_to_string(in_slotA, constA), input_to_string(in_slotB, constB))
         str += "[+] Constant pool: size=%u\n" % len(self.constant_pool)
         if detailed:
             for i, const in enumerate(self.constant_pool):
                 str += "\t%2u %4.2f\n" % (i, const)
         return str
 
-    # Evaluate the tape, given float values for x, y, z and t.
+    # Evaluate the tape, given values for x, y, z and t.
+    # V is the value module to use (see values.py) : by default we evaluate on floats.
     # This should only be used for debug purposes : 
     # tape evaluation should really happen on the GPU.
-    def eval(self, x, y, z, t):
+    def eval(self, x, y, z, t, V = values.Scalar):
         slots = [None for _ in range(self.slot_count)]
         slots[0] = x
         slots[1] = y
         slots[2] = z
         slots[3] = t
+        for instr in self.instructions:
+            self.exec(instr, slots, V)
+        return slots[self.out_slot]
+
+    # Execute a single instruction on the slots (in place).
+    def exec(self, instr, slots, V = values.Scalar):
+        op, out_slot, in_slotA, in_slotB, constA, constB = decode_instruction(instr)
+        a, b = self.operands(op, in_slotA, in_slotB, constA, constB, slots, V)
+        if op == OP_CONST: slots[out_slot]  = a
+        elif op == OP_SIN: slots[out_slot]  = V.sin(a)
+        elif op == OP_COS: slots[out_slot]  = V.cos(a)
+        elif op == OP_EXP: slots[out_slot]  = V.exp(a)
+        elif op == OP_SQRT: slots[out_slot] = V.sqrt(a)
+        elif op == OP_NEG: slots[out_slot]  = V.neg(a)
+        elif op == OP_ADD: slots[out_slot]  = V.add(a, b)
+        elif op == OP_SUB: slots[out_slot]  = V.sub(a, b)
+        elif op == OP_MUL: slots[out_slot]  = V.mul(a, b)
+        elif op == OP_DIV: slots[out_slot]  = V.div(a, b)
+        elif op == OP_MIN: slots[out_slot]  = V.min(a, b)
+        elif op == OP_MAX: slots[out_slot]  = V.max(a, b)
+        elif op == OP_COPY: slots[out_slot] = V.copy(a)
+        elif op == OP_SQUARE: slots[out_slot] = V.square(a)
+        elif op == OP_ABS: slots[out_slot] = V.abs(a)
+        elif op == OP_FMA: slots[out_slot] = V.fma(a, b, slots[out_slot])
+        elif op == OP_FLOOR: slots[out_slot] = V.floor(a)
+        elif op == OP_MOD: slots[out_slot] = V.mod(a, b)
+        else: assert(False)
 
+    # Read the inputs of an instruction, from the constant pool for immediate constants.
+    # An input is only read if the operator uses it : the index of an unused input 
+    # can be anything, and OP_CONST always reads the constant pool.
+    def operands(self, op, in_slotA, in_slotB, constA, constB, slots, V = values.Scalar):
+        def read(s, const):
+            return V.constant(self.constant_pool[s]) if const else slots[s]
+        a = read(in_slotA, constA or op == OP_CONST)
+        b = read(in_slotB, constB) if op in BINARY_OPS else None
+        return a, b
+
+    # Shorten the tape over the box given by an interval for each axis (t is a float),
+    # like shorten_tape in tape.fut : the MIN/MAX instructions that always select the same input 
+    # become copies, and the instructions whose output is never read are removed.
+    # The new tape is only valid inside the box.
+    def shorten(self, ix, iy, iz, t):
+        V = values.Interval
+        instrs = [list(decode_instruction(instr)) for instr in self.instructions]
+        # Record the choices of the MIN/MAX instructions.
+        choices = []
+        slots = [None for _ in range(self.slot_count)]
+        slots[0], slots[1], slots[2], slots[3] = ix, iy, iz, V.constant(t)
         for instr in self.instructions:
-            op, out_slot, in_slotA, in_slotB = decode_instruction(instr)
-            if op == OP_CONST: slots[out_slot]  = self.constant_pool[in_slotA]
-            elif op == OP_SIN: slots[out_slot]  = math.sin(slots[in_slotA])
-            elif op == OP_COS: slots[out_slot]  = math.cos(slots[in_slotA])
-            elif op == OP_EXP: slots[out_slot]  = math.exp(slots[in_slotA])
-            elif op == OP_SQRT: slots[out_slot] = math.sqrt(slots[in_slotA])
-            elif op == OP_NEG: slots[out_slot]  = -slots[in_slotA]
-            elif op == OP_ADD: slots[out_slot]  = slots[in_slotA] + slots[in_slotB]
-            elif op == OP_SUB: slots[out_slot]  = slots[in_slotA] - slots[in_slotB]
-            elif op == OP_MUL: slots[out_slot]  = slots[in_slotA] * slots[in_slotB]
-            elif op == OP_DIV: slots[out_slot]  = slots[in_slotA] / slots[in_slotB]
-            elif op == OP_MIN: slots[out_slot]  = min(slots[in_slotA], slots[in_slotB])
-            elif op == OP_MAX: slots[out_slot]  = max(slots[in_slotA], slots[in_slotB])
-            elif op == OP_COPY: slots[out_slot] = slots[in_slotA]
-            else: assert(False)
-
-        return slots[0]
\ No newline at end of file
+            op, out_slot, in_slotA, in_slotB, constA, constB = decode_instruction(instr)
+            choice = None
+            if op in [OP_MIN, OP_MAX]:
+                a, b = self.operands(op, in_slotA, in_slotB, constA, constB, slots, V)
+            if op == OP_MIN:
+                if a.high <= b.low: choice = 'A'
+                elif b.high <= a.low: choice = 'B'
+            elif op == OP_MAX:
+                if a.low >= b.high: choice = 'A'
+                elif b.low >= a.high: choice = 'B'
+            choices.append(choice)
+            self.exec(instr, slots, V)
+        # Remove the dead instructions, going backwards.
+        live = [False for _ in range(self.slot_count)]
+        live[self.out_slot] = True
+        kept = []
+        for i in reversed(range(len(instrs))):
+            op, out_slot, in_slotA, in_slotB, constA, constB = instrs[i]
+            if not live[out_slot]: continue
+            if choices[i] == 'A': op = OP_COPY
+            elif choices[i] == 'B': op, in_slotA, constA = OP_COPY, in_slotB, constB
+            if op == OP_COPY and not constA and in_slotA == out_slot: continue
+            if op != OP_FMA: live[out_slot] = False
+            if op != OP_CONST and not constA: live[in_slotA] = True
+            if op in BINARY_OPS and not constB: live[in_slotB] = True
+            kept.append(encode_instruction(op, out_slot, in_slotA, in_slotB, constA, constB))
+        tap = Tape.from_instructions(list(reversed(kept)), self.constant_pool, self.slot_count)
+        tap.out_slot = self.out_slot
+        return tap
+
+    # Bound the tape over the box given by an interval for each axis (t is a float),
+    # using interval arithmetic, affine arithmetic or the centered form 
+    # (mode is "interval", "affine" or "centered", see bound_mode in voxelizer.fut). This returns an interval.
+    def eval_bounds(self, ix, iy, iz, t, mode = "interval"):
+        if mode == "affine":
+            ax, ay, az = values.Affine.axes(ix, iy, iz)
+            return self.eval(ax, ay, az, values.Affine.constant(t), values.Affine).to_interval()
+        elif mode == "centered":
+            cx, cy, cz = values.Centered.axes(ix, iy, iz)
+            radii = [(i.high - i.low) / 2.0 for i in [ix, iy, iz]]
+            return self.eval(cx, cy, cz, values.Centered.constant(t), values.Centered).to_interval(*radii)
+        else:
+            assert(mode == "interval")
+            return self.eval(ix, iy, iz, values.Interval.constant(t), values.Interval)
+
+# The arguments that describe a tape in the entry points of the engine.
+def tape_args(tap):
+    return (np.array(tap.instructions, dtype = np.uint32), 
+            np.array(tap.constant_pool, dtype = np.float32),
+            tap.slot_count)
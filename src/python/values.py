@@ -0,0 +1,532 @@
+import math
+from collections import namedtuple
+import numpy as np
+
+
+# Host-side versions of the value modules in tape.fut.
+# Each value type is a class with static methods for the tape operators,
+# so that it can be passed to Tape.eval just like a module is passed to mk_tape_evaluator.
+# Careful : these should give the same results as their futhark counterparts.
+
+class Scalar:
+    @staticmethod
+    def constant(x): return float(x)
+    @staticmethod
+    def sin(a): return math.sin(a)
+    @staticmethod
+    def cos(a): return math.cos(a)
+    @staticmethod
+    def exp(a): return math.exp(a)
+    @staticmethod
+    def sqrt(a): return math.sqrt(a)
+    @staticmethod
+    def neg(a): return -a
+    @staticmethod
+    def add(a, b): return a + b
+    @staticmethod
+    def sub(a, b): return a - b
+    @staticmethod
+    def mul(a, b): return a * b
+    @staticmethod
+    def div(a, b): return a / b
+    @staticmethod
+    def min(a, b): return min(a, b)
+    @staticmethod
+    def max(a, b): return max(a, b)
+    @staticmethod
+    def copy(a): return a
+    @staticmethod
+    def square(a): return a * a
+    @staticmethod
+    def abs(a): return abs(a)
+    @staticmethod
+    def fma(a, b, c): return a * b + c
+    @staticmethod
+    def floor(a): return float(math.floor(a))
+    @staticmethod
+    def mod(a, b): return a - b * math.floor(a / b)
+
+
+# An interval of floats, with endpoints included.
+# An endpoint can be inf/-inf, but it should NEVER be nan.
+class Interval(namedtuple('Interval', ['low', 'high'])):
+    # If an endpoint is nan, replace it with inf/-inf.
+    @staticmethod
+    def remove_nans(a):
+        return Interval(
+            -math.inf if math.isnan(a.low) else a.low,
+            math.inf if math.isnan(a.high) else a.high)
+
+    # Is there an integer in [low, high] ? This works for inf/nan inputs.
+    @staticmethod
+    def contains_int(low, high):
+        if math.isnan(low) or math.isnan(high): return False
+        if low == math.inf or high == -math.inf: return False
+        return low <= math.floor(high)
+
+    # Python's math functions raise an error where futhark's return nan or inf.
+    @staticmethod
+    def safe(f, x):
+        try: return f(x)
+        except ValueError: return math.nan
+        except OverflowError: return math.inf
+
+    @staticmethod
+    def constant(x): return Interval.remove_nans(Interval(float(x), float(x)))
+
+    @staticmethod
+    def sin(a):
+        sl, sh = Interval.safe(math.sin, a.low), Interval.safe(math.sin, a.high)
+        nan = math.isnan(sl) or math.isnan(sh)
+        two_pi = 2 * math.pi
+        low = -1.0 if nan or Interval.contains_int(a.low / two_pi - 3/4, a.high / two_pi - 3/4) else min(sl, sh)
+        high = 1.0 if nan or Interval.contains_int(a.low / two_pi - 1/4, a.high / two_pi - 1/4) else max(sl, sh)
+        return Interval(low, high)
+
+    @staticmethod
+    def cos(a):
+        cl, ch = Interval.safe(math.cos, a.low), Interval.safe(math.cos, a.high)
+        nan = math.isnan(cl) or math.isnan(ch)
+        two_pi = 2 * math.pi
+        low = -1.0 if nan or Interval.contains_int(a.low / two_pi - 1/2, a.high / two_pi - 1/2) else min(cl, ch)
+        high = 1.0 if nan or Interval.contains_int(a.low / two_pi, a.high / two_pi) else max(cl, ch)
+        return Interval(low, high)
+
+    @staticmethod
+    def exp(a):
+        return Interval(Interval.safe(math.exp, a.low), Interval.safe(math.exp, a.high))
+
+    @staticmethod
+    def sqrt(a):
+        return Interval.remove_nans(Interval(Interval.safe(math.sqrt, a.low), Interval.safe(math.sqrt, a.high)))
+
+    @staticmethod
+    def neg(a): return Interval(-a.high, -a.low)
+
+    @staticmethod
+    def add(a, b): return Interval.remove_nans(Interval(a.low + b.low, a.high + b.high))
+
+    @staticmethod
+    def sub(a, b): return Interval.add(a, Interval.neg(b))
+
+    # We can create nans if multiplying 0 with infinity : like f32.min/f32.max, ignore them.
+    @staticmethod
+    def mul(a, b):
+        ps = [a.low * b.low, a.low * b.high, a.high * b.low, a.high * b.high]
+        ps = [p for p in ps if not math.isnan(p)]
+        if len(ps) == 0: return Interval(-math.inf, math.inf)
+        return Interval(min(ps), max(ps))
+
+    @staticmethod
+    def inv(a):
+        if a.low <= 0.0 and a.high >= 0.0: return Interval(-math.inf, math.inf)
+        return Interval(1.0 / a.high, 1.0 / a.low)
+
+    @staticmethod
+    def div(a, b): return Interval.mul(a, Interval.inv(b))
+    @staticmethod
+    def min(a, b): return Interval(min(a.low, b.low), min(a.high, b.high))
+    @staticmethod
+    def max(a, b): return Interval(max(a.low, b.low), max(a.high, b.high))
+    @staticmethod
+    def copy(a): return a
+
+    @staticmethod
+    def square(a):
+        if a.low >= 0.0: return Interval(a.low * a.low, a.high * a.high)
+        if a.high <= 0.0: return Interval(a.high * a.high, a.low * a.low)
+        return Interval(0.0, max(a.low * a.low, a.high * a.high))
+
+    @staticmethod
+    def abs(a):
+        if a.low >= 0.0: return a
+        if a.high <= 0.0: return Interval.neg(a)
+        return Interval(0.0, max(-a.low, a.high))
+
+    @staticmethod
+    def fma(a, b, c): return Interval.add(Interval.mul(a, b), c)
+
+    # math.floor raises an error on inf.
+    @staticmethod
+    def floor(a):
+        fl = lambda x: x if math.isinf(x) else float(math.floor(x))
+        return Interval(fl(a.low), fl(a.high))
+
+    @staticmethod
+    def mod(a, b):
+        k = Interval.floor(Interval.div(a, b))
+        if k.low == k.high and not math.isinf(k.low): 
+            return Interval.sub(a, Interval.mul(b, Interval.constant(k.low)))
+        if b.low > 0.0: return Interval(0.0, b.high)
+        if b.high < 0.0: return Interval(b.low, 0.0)
+        m = max(-b.low, b.high)
+        return Interval(-m, m)
+
+
+# A batch of intervals, as NumPy arrays of endpoints (in double precision, like Interval).
+# The operators are the ones of Interval, elementwise : BatchEvaluator.eval_bounds
+# bounds many boxes in one pass over the tape. Run them with np.errstate(all = 'ignore').
+class Intervals(namedtuple('Intervals', ['low', 'high'])):
+    @staticmethod
+    def remove_nans(a):
+        return Intervals(np.where(np.isnan(a.low), -np.inf, a.low), np.where(np.isnan(a.high), np.inf, a.high))
+
+    @staticmethod
+    def contains_int(low, high):
+        return ~np.isnan(low) & ~np.isnan(high) & (low != np.inf) & (high != -np.inf) & (low <= np.floor(high))
+
+    @staticmethod
+    def constant(x): return Intervals.remove_nans(Intervals(np.float64(x), np.float64(x)))
+
+    @staticmethod
+    def sin(a):
+        sl, sh = np.sin(a.low), np.sin(a.high)
+        nan = np.isnan(sl) | np.isnan(sh)
+        two_pi = 2 * math.pi
+        low = np.where(nan | Intervals.contains_int(a.low / two_pi - 3/4, a.high / two_pi - 3/4), -1.0, np.minimum(sl, sh))
+        high = np.where(nan | Intervals.contains_int(a.low / two_pi - 1/4, a.high / two_pi - 1/4), 1.0, np.maximum(sl, sh))
+        return Intervals(low, high)
+
+    @staticmethod
+    def cos(a):
+        cl, ch = np.cos(a.low), np.cos(a.high)
+        nan = np.isnan(cl) | np.isnan(ch)
+        two_pi = 2 * math.pi
+        low = np.where(nan | Intervals.contains_int(a.low / two_pi - 1/2, a.high / two_pi - 1/2), -1.0, np.minimum(cl, ch))
+        high = np.where(nan | Intervals.contains_int(a.low / two_pi, a.high / two_pi), 1.0, np.maximum(cl, ch))
+        return Intervals(low, high)
+
+    @staticmethod
+    def exp(a): return Intervals(np.exp(a.low), np.exp(a.high))
+
+    @staticmethod
+    def sqrt(a): return Intervals.remove_nans(Intervals(np.sqrt(a.low), np.sqrt(a.high)))
+
+    @staticmethod
+    def neg(a): return Intervals(-a.high, -a.low)
+
+    @staticmethod
+    def add(a, b): return Intervals.remove_nans(Intervals(a.low + b.low, a.high + b.high))
+
+    @staticmethod
+    def sub(a, b): return Intervals.add(a, Intervals.neg(b))
+
+    # np.fmin and np.fmax ignore the nans of 0 * inf, unless all the products are nan.
+    @staticmethod
+    def mul(a, b):
+        ps = [a.low * b.low, a.low * b.high, a.high * b.low, a.high * b.high]
+        low = np.fmin(np.fmin(ps[0], ps[1]), np.fmin(ps[2], ps[3]))
+        high = np.fmax(np.fmax(ps[0], ps[1]), np.fmax(ps[2], ps[3]))
+        return Intervals.remove_nans(Intervals(low, high))
+
+    @staticmethod
+    def inv(a):
+        zero = (a.low <= 0.0) & (a.high >= 0.0)
+        return Intervals(np.where(zero, -np.inf, 1.0 / a.high), np.where(zero, np.inf, 1.0 / a.low))
+
+    @staticmethod
+    def div(a, b): return Intervals.mul(a, Intervals.inv(b))
+    @staticmethod
+    def min(a, b): return Intervals(np.minimum(a.low, b.low), np.minimum(a.high, b.high))
+    @staticmethod
+    def max(a, b): return Intervals(np.maximum(a.low, b.low), np.maximum(a.high, b.high))
+    @staticmethod
+    def copy(a): return a
+
+    @staticmethod
+    def square(a):
+        ll, hh = a.low * a.low, a.high * a.high
+        low = np.where(a.low >= 0.0, ll, np.where(a.high <= 0.0, hh, 0.0))
+        high = np.where(a.low >= 0.0, hh, np.where(a.high <= 0.0, ll, np.maximum(ll, hh)))
+        return Intervals(low, high)
+
+    @staticmethod
+    def abs(a):
+        low = np.where(a.low >= 0.0, a.low, np.where(a.high <= 0.0, -a.high, 0.0))
+        high = np.where(a.low >= 0.0, a.high, np.where(a.high <= 0.0, -a.low, np.maximum(-a.low, a.high)))
+        return Intervals(low, high)
+
+    @staticmethod
+    def fma(a, b, c): return Intervals.add(Intervals.mul(a, b), c)
+
+    @staticmethod
+    def floor(a): return Intervals(np.floor(a.low), np.floor(a.high))
+
+    @staticmethod
+    def mod(a, b):
+        k = Intervals.floor(Intervals.div(a, b))
+        exact = (k.low == k.high) & np.isfinite(k.low)
+        e = Intervals.sub(a, Intervals.mul(b, Intervals.remove_nans(Intervals(k.low, k.low))))
+        m = np.maximum(-b.low, b.high)
+        low = np.where(exact, e.low, np.where(b.low > 0.0, 0.0, np.where(b.high < 0.0, b.low, -m)))
+        high = np.where(exact, e.high, np.where(b.low > 0.0, b.high, np.where(b.high < 0.0, 0.0, m)))
+        return Intervals(low, high)
+
+
+# An affine form c + ex*ex' + ey*ey' + ez*ez' + err*e', where the noise symbols ex', ey', ez'
+# stand for the position along each axis and e' for everything else (see affine_form in tape.fut).
+class Affine(namedtuple('Affine', ['c', 'ex', 'ey', 'ez', 'err'])):
+    # Build the affine forms of the axes over a box given by its intervals along each axis.
+    @staticmethod
+    def axes(ix, iy, iz):
+        def axis(i, k):
+            e = [0.0, 0.0, 0.0]
+            e[k] = (i.high - i.low) / 2.0
+            return Affine((i.low + i.high) / 2.0, *e, 0.0)
+        return axis(ix, 0), axis(iy, 1), axis(iz, 2)
+
+    EVERYTHING = None # set after the class definition
+
+    def radius(self):
+        return abs(self.ex) + abs(self.ey) + abs(self.ez) + self.err
+
+    def to_interval(self):
+        r = self.radius()
+        return Interval(self.c - r, self.c + r)
+
+    # This loses all correlations.
+    @staticmethod
+    def from_interval(i):
+        if math.isinf(i.low) or math.isinf(i.high): return Affine.EVERYTHING
+        return Affine((i.low + i.high) / 2.0, 0.0, 0.0, 0.0, (i.high - i.low) / 2.0)
+
+    # Only the error term can be infinite.
+    @staticmethod
+    def remove_nans(a):
+        bad = lambda x: math.isnan(x) or math.isinf(x)
+        if bad(a.c) or bad(a.ex) or bad(a.ey) or bad(a.ez) or math.isnan(a.err):
+            return Affine.EVERYTHING
+        return a
+
+    @staticmethod
+    def via_interval(f, a):
+        return Affine.from_interval(f(a.to_interval()))
+
+    # Min-range linear approximation f(a) ~ alpha*a + zeta +- delta.
+    @staticmethod
+    def min_range(f, alpha, a):
+        i = a.to_interval()
+        try:
+            d_low = f(i.low) - alpha * i.low
+            d_high = f(i.high) - alpha * i.high
+        except OverflowError:
+            return Affine.EVERYTHING
+        return Affine.remove_nans(Affine(
+            alpha * a.c + (d_low + d_high) / 2.0,
+            alpha * a.ex, alpha * a.ey, alpha * a.ez,
+            abs(alpha) * a.err + abs(d_high - d_low) / 2.0))
+
+    @staticmethod
+    def constant(x): return Affine.remove_nans(Affine(float(x), 0.0, 0.0, 0.0, 0.0))
+    @staticmethod
+    def sin(a): return Affine.via_interval(Interval.sin, a)
+    @staticmethod
+    def cos(a): return Affine.via_interval(Interval.cos, a)
+
+    @staticmethod
+    def exp(a):
+        i = a.to_interval()
+        if math.isinf(i.low) or math.isinf(i.high): return Affine.via_interval(Interval.exp, a)
+        return Affine.min_range(math.exp, Interval.safe(math.exp, i.low), a)
+
+    @staticmethod
+    def sqrt(a):
+        i = a.to_interval()
+        if i.low <= 0.0 or math.isinf(i.high): return Affine.via_interval(Interval.sqrt, a)
+        return Affine.min_range(math.sqrt, 0.5 / math.sqrt(i.high), a)
+
+    @staticmethod
+    def neg(a): return Affine(-a.c, -a.ex, -a.ey, -a.ez, a.err)
+
+    @staticmethod
+    def add(a, b):
+        return Affine.remove_nans(Affine(a.c + b.c, a.ex + b.ex, a.ey + b.ey, a.ez + b.ez, a.err + b.err))
+
+    @staticmethod
+    def sub(a, b): return Affine.add(a, Affine.neg(b))
+
+    @staticmethod
+    def mul(a, b):
+        return Affine.remove_nans(Affine(
+            a.c * b.c,
+            a.c * b.ex + b.c * a.ex,
+            a.c * b.ey + b.c * a.ey,
+            a.c * b.ez + b.c * a.ez,
+            abs(a.c) * b.err + abs(b.c) * a.err + a.radius() * b.radius()))
+
+    @staticmethod
+    def inv(a):
+        i = a.to_interval()
+        if i.low <= 0.0 and i.high >= 0.0: return Affine.EVERYTHING
+        if math.isinf(i.low) or math.isinf(i.high): return Affine.via_interval(Interval.inv, a)
+        far = i.high if i.low > 0.0 else i.low
+        return Affine.min_range(lambda x: 1.0 / x, -1.0 / (far * far), a)
+
+    @staticmethod
+    def div(a, b): return Affine.mul(a, Affine.inv(b))
+
+    @staticmethod
+    def min(a, b):
+        ia, ib = a.to_interval(), b.to_interval()
+        if ia.high <= ib.low: return a
+        if ib.high <= ia.low: return b
+        return Affine.from_interval(Interval.min(ia, ib))
+
+    @staticmethod
+    def max(a, b):
+        ia, ib = a.to_interval(), b.to_interval()
+        if ia.high <= ib.low: return b
+        if ib.high <= ia.low: return a
+        return Affine.from_interval(Interval.max(ia, ib))
+
+    @staticmethod
+    def copy(a): return a
+
+    @staticmethod
+    def square(a):
+        r = a.radius()
+        return Affine.remove_nans(Affine(
+            a.c * a.c + r * r / 2.0,
+            2.0 * a.c * a.ex, 2.0 * a.c * a.ey, 2.0 * a.c * a.ez,
+            2.0 * abs(a.c) * a.err + r * r / 2.0))
+
+    @staticmethod
+    def abs(a):
+        i = a.to_interval()
+        if i.low >= 0.0: return a
+        if i.high <= 0.0: return Affine.neg(a)
+        return Affine.via_interval(Interval.abs, a)
+
+    @staticmethod
+    def fma(a, b, c): return Affine.add(Affine.mul(a, b), c)
+
+    @staticmethod
+    def floor(a): return Affine.via_interval(Interval.floor, a)
+
+    @staticmethod
+    def mod(a, b):
+        ia, ib = a.to_interval(), b.to_interval()
+        k = Interval.floor(Interval.div(ia, ib))
+        if k.low == k.high and not math.isinf(k.low): 
+            return Affine.sub(a, Affine.mul(b, Affine.constant(k.low)))
+        return Affine.from_interval(Interval.mod(ia, ib))
+
+Affine.EVERYTHING = Affine(0.0, 0.0, 0.0, 0.0, math.inf)
+
+
+# A centered form (see centered_form in tape.fut) : the value at the center of the box,
+# the value over the box and the partial derivatives over the box, all as intervals.
+# By the mean value theorem, f(box) is inside f(center) + sum of df/dx_i(box) * (x_i - center_i).
+class Centered(namedtuple('Centered', ['c', 'v', 'dx', 'dy', 'dz'])):
+    ZERO = Interval(0.0, 0.0)
+    EVERYTHING = Interval(-math.inf, math.inf)
+
+    # Build the centered forms of the axes over a box given by its intervals along each axis.
+    @staticmethod
+    def axes(ix, iy, iz):
+        def axis(i, k):
+            d = [Centered.ZERO, Centered.ZERO, Centered.ZERO]
+            d[k] = Interval(1.0, 1.0)
+            return Centered(Interval.constant((i.low + i.high) / 2.0), i, *d)
+        return axis(ix, 0), axis(iy, 1), axis(iz, 2)
+
+    # Bound the value over the box, given the radius of the box along each axis :
+    # the mean value form is intersected with the value over the box, so this is never wider.
+    def to_interval(self, rx, ry, rz):
+        ox, oy, oz = Interval(-rx, rx), Interval(-ry, ry), Interval(-rz, rz)
+        mv = Interval.add(self.c, Interval.add(Interval.mul(self.dx, ox), 
+            Interval.add(Interval.mul(self.dy, oy), Interval.mul(self.dz, oz))))
+        low, high = max(self.v.low, mv.low), min(self.v.high, mv.high)
+        # The two bounds can only miss each other because of rounding errors.
+        return Interval(low, high) if low <= high else self.v
+
+    def grad(self):
+        return [self.dx, self.dy, self.dz]
+
+    # The chain rule : the derivatives of the result are the ones of a times k.
+    @staticmethod
+    def chain(c, v, k, a):
+        return Centered(c, v, *[Interval.mul(k, d) for d in a.grad()])
+
+    @staticmethod
+    def hull(a, b): return Interval(min(a.low, b.low), max(a.high, b.high))
+
+    @staticmethod
+    def constant(x):
+        i = Interval.constant(x)
+        return Centered(i, i, Centered.ZERO, Centered.ZERO, Centered.ZERO)
+    @staticmethod
+    def sin(a): return Centered.chain(Interval.sin(a.c), Interval.sin(a.v), Interval.cos(a.v), a)
+    @staticmethod
+    def cos(a): return Centered.chain(Interval.cos(a.c), Interval.cos(a.v), Interval.neg(Interval.sin(a.v)), a)
+    @staticmethod
+    def exp(a): return Centered.chain(Interval.exp(a.c), Interval.exp(a.v), Interval.exp(a.v), a)
+    @staticmethod
+    def sqrt(a):
+        v = Interval.sqrt(a.v)
+        return Centered.chain(Interval.sqrt(a.c), v, Interval.div(Interval(0.5, 0.5), v), a)
+    @staticmethod
+    def neg(a): return Centered(*[Interval.neg(i) for i in a])
+    @staticmethod
+    def add(a, b): return Centered(*[Interval.add(i, j) for i, j in zip(a, b)])
+    @staticmethod
+    def sub(a, b): return Centered(*[Interval.sub(i, j) for i, j in zip(a, b)])
+
+    @staticmethod
+    def mul(a, b):
+        return Centered(Interval.mul(a.c, b.c), Interval.mul(a.v, b.v), *[
+            Interval.add(Interval.mul(da, b.v), Interval.mul(a.v, db)) for da, db in zip(a.grad(), b.grad())])
+
+    @staticmethod
+    def div(a, b):
+        b2 = Interval.square(b.v)
+        return Centered(Interval.div(a.c, b.c), Interval.div(a.v, b.v), *[
+            Interval.div(Interval.sub(Interval.mul(da, b.v), Interval.mul(a.v, db)), b2) 
+            for da, db in zip(a.grad(), b.grad())])
+
+    # Where neither input is always the smallest, the derivative is the one of either input.
+    @staticmethod
+    def min(a, b):
+        if a.v.high <= b.v.low: return a
+        if b.v.high <= a.v.low: return b
+        return Centered(Interval.min(a.c, b.c), Interval.min(a.v, b.v), 
+            *[Centered.hull(da, db) for da, db in zip(a.grad(), b.grad())])
+
+    @staticmethod
+    def max(a, b):
+        if a.v.low >= b.v.high: return a
+        if b.v.low >= a.v.high: return b
+        return Centered(Interval.max(a.c, b.c), Interval.max(a.v, b.v), 
+            *[Centered.hull(da, db) for da, db in zip(a.grad(), b.grad())])
+
+    @staticmethod
+    def copy(a): return a
+
+    @staticmethod
+    def square(a):
+        return Centered.chain(Interval.square(a.c), Interval.square(a.v), Interval.mul(Interval(2.0, 2.0), a.v), a)
+
+    @staticmethod
+    def abs(a):
+        if a.v.low >= 0.0: return a
+        if a.v.high <= 0.0: return Centered.neg(a)
+        return Centered(Interval.abs(a.c), Interval.abs(a.v), *[Centered.hull(d, Interval.neg(d)) for d in a.grad()])
+
+    @staticmethod
+    def fma(a, b, c): return Centered.add(Centered.mul(a, b), c)
+
+    # floor is piecewise constant, but its jumps have no derivative : 
+    # the mean value form is useless on a box that contains one.
+    @staticmethod
+    def floor(a):
+        k = Interval.floor(a.v)
+        d = Centered.ZERO if k.low == k.high and not math.isinf(k.low) else Centered.EVERYTHING
+        return Centered(Interval.floor(a.c), k, d, d, d)
+
+    @staticmethod
+    def mod(a, b):
+        k = Interval.floor(Interval.div(a.v, b.v))
+        if k.low == k.high and not math.isinf(k.low): 
+            return Centered.sub(a, Centered.mul(b, Centered.constant(k.low)))
+        e = Centered.EVERYTHING
+        return Centered(Interval.mod(a.c, b.c), Interval.mod(a.v, b.v), e, e, e)
@@ -0,0 +1,88 @@
+import json
+import numpy as np
+
+
+# Save voxels to files, so that a scene can be voxelized once and rendered or analyzed many times.
+# A file starts with a magic string and the length of a JSON header, that gives the kind of voxels,
+# the frame, the level dims, the layout of the masks (see mask_layout in voxelizer.fut) 
+# and the dtype, shape and offset of each array.
+# The arrays follow as raw little-endian data : the masks are already bit-packed by the engine.
+# The arrays are aligned so that loading maps them with np.memmap, without copying or parsing,
+# and they can be passed to the engine as they are.
+MAGIC = b"FREPVOX1"
+ALIGN = 64
+
+# The arrays of each kind of voxels, in the order of the export and import entry points (see dda.fut).
+VOXELS_ARRAYS = ["L0_pos", "L0_leaf", "L0_child", "L0_list", "L1_pos", "L1_leaf", "L1_child", "L1_list", "L2_leaf"]
+BRICKS_ARRAYS = ["index", "bricks"]
+
+def align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+# Write arrays (a dict from names to arrays) to a file, with the kind, frame, dims and layout in the header.
+# frame is (x, y, z, size), morton is true if the masks are in Morton order.
+def save(path, kind, frame, dims, arrays, morton = False):
+    arrays = { name : np.ascontiguousarray(a, dtype = a.dtype.newbyteorder('<')) for name, a in arrays.items() }
+    header = { 
+        "kind" : kind, "frame" : [float(x) for x in frame], "dims" : [int(d) for d in dims], 
+        "morton" : bool(morton), "arrays" : [] }
+    # The offsets are relative to the start of the data, right after the header.
+    offset = 0
+    for name, a in arrays.items():
+        header["arrays"].append({ "name" : name, "dtype" : a.dtype.str, "shape" : list(a.shape), "offset" : offset })
+        offset = align(offset + a.nbytes)
+    text = json.dumps(header).encode("utf-8")
+    start = align(len(MAGIC) + 8 + len(text))
+
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array(len(text), dtype = '<u8').tobytes())
+        f.write(text)
+        for entry in header["arrays"]:
+            f.seek(start + entry["offset"])
+            f.write(arrays[entry["name"]].tobytes())
+        # The file extends over the padding of the last array.
+        f.truncate(start + offset)
+
+# Read a file written by save. This returns the kind, frame, dims, layout and a dict of arrays,
+# that are memory-mapped (read-only) from the file.
+def load(path):
+    with open(path, 'rb') as f:
+        assert(f.read(len(MAGIC)) == MAGIC)
+        size = int(np.frombuffer(f.read(8), dtype = '<u8')[0])
+        header = json.loads(f.read(size).decode("utf-8"))
+    start = align(len(MAGIC) + 8 + size)
+    arrays = dict()
+    for entry in header["arrays"]:
+        shape = tuple(entry["shape"])
+        # np.memmap can't map an empty array.
+        if np.prod(shape) == 0:
+            arrays[entry["name"]] = np.empty(shape, dtype = entry["dtype"])
+        else:
+            arrays[entry["name"]] = np.memmap(path, dtype = entry["dtype"], mode = 'r', offset = start + entry["offset"], shape = shape)
+    # Files written before the Morton layout are linear.
+    return header["kind"], header["frame"], header["dims"], header.get("morton", False), arrays
+
+# Save voxels built by the voxelize entry point. dims are the level dims (d0, d1, d2).
+def save_voxels(path, fut, voxels, dims):
+    frame, morton, *levels = fut.export_voxels(voxels)
+    save(path, "voxels", frame.get(), dims, dict(zip(VOXELS_ARRAYS, [a.get() for a in levels])), morton = morton)
+
+# Load voxels saved by save_voxels straight into the engine.
+# This returns the voxels (for the render entry point) and the level dims.
+def load_voxels(path, fut):
+    kind, frame, dims, morton, arrays = load(path)
+    assert(kind == "voxels")
+    return fut.import_voxels(*frame, morton, *[arrays[name] for name in VOXELS_ARRAYS]), dims
+
+# Save a brick map built by the voxelize_bricks entry point. dims are the brick map dims (c, b).
+def save_bricks(path, fut, bricks, dims):
+    frame, morton, *arrays = fut.export_bricks(bricks)
+    save(path, "bricks", frame.get(), dims, dict(zip(BRICKS_ARRAYS, [a.get() for a in arrays])), morton = morton)
+
+# Load a brick map saved by save_bricks straight into the engine.
+# This returns the brick map (for the render_bricks entry point) and its dims.
+def load_bricks(path, fut):
+    kind, frame, dims, morton, arrays = load(path)
+    assert(kind == "bricks")
+    return fut.import_bricks(*frame, morton, *[arrays[name] for name in BRICKS_ARRAYS]), dims